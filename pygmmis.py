@@ -5,6 +5,7 @@ import ctypes
 
 import logging
 logger = logging.getLogger("pygmmis")
+import time
 
 def createShared(a, dtype=ctypes.c_double):
     """Create a shared array to be used for multiprocessing's processes.
@@ -126,7 +127,7 @@ def match1d(arr1input, arr2input, presorted=False):
     return sub1,sub2
 
 
-def logsum(logX, axis=0):
+def logsum(logX, axis=0, buf=None):
     """Computes log of the sum along give axis from the log of the summands.
 
     This method tries hard to avoid over- or underflow.
@@ -135,6 +136,8 @@ def logsum(logX, axis=0):
     Args:
         logX: numpy array of logarithmic summands
         axis (int): axis to sum over
+        buf: numpy array with the shape of logX for intermediate results,
+            will be allocated if None
 
     Returns:
         log of the sum, shortened by one axis
@@ -150,7 +153,8 @@ def logsum(logX, axis=0):
     # adjust the shape of c for addition with logX
     c_shape = [slice(None) for i in xrange(len(logX.shape))]
     c_shape[axis] = None
-    return np.log(np.exp(logX + c[c_shape]).sum(axis=axis)) - c
+    buf = np.add(logX, c[tuple(c_shape)], out=buf)
+    return np.log(np.exp(buf, out=buf).sum(axis=axis)) - c
 
 
 def chi2_cutoff(D, cutoff=3.):
@@ -182,19 +186,295 @@ def covar_callback_default(coords, default=None):
     return default
 
 
+class _Workspace(object):
+    """Reusable buffers to avoid repeated allocations during EM iterations.
+
+    Buffers are identified by name and grow as needed, so that subsequent
+    requests for the same or smaller sizes are served from the same memory.
+    An array returned by get() is valid until the next get() with that name.
+    """
+    def __init__(self):
+        self._buffers = {}
+
+    def get(self, name, shape, dtype='float64'):
+        """Get buffer of given name, shape, and dtype.
+
+        Args:
+            name (str): identifier of the buffer
+            shape (int or tuple): shape of the returned array
+            dtype: numpy dtype of the returned array
+
+        Returns:
+            numpy array with undefined content
+        """
+        shape = tuple(np.atleast_1d(shape))
+        size = int(np.prod(shape))
+        dtype = np.dtype(dtype)
+        buf = self._buffers.get(name, None)
+        if buf is None or buf.dtype != dtype:
+            buf = self._buffers[name] = np.empty(size, dtype=dtype)
+        elif buf.size < size:
+            # grow by at least half to avoid frequent reallocations
+            buf = self._buffers[name] = np.empty(max(size, buf.size * 3 // 2), dtype=dtype)
+        return buf[:size].reshape(shape)
+
+# workspace for each process of the pool, where _Esum and _Msums are run
+_worker_workspace = _Workspace()
+
+
+class _Checkpoint(object):
+    """Checkpoints of a fit in a directory.
+
+    Each checkpoint is a subdirectory with arrays stored as .npy files. The
+    manifest (JSON) points to the current one and is replaced atomically, so
+    that an interrupted save leaves the previous checkpoint intact. Arrays are
+    loaded as memory maps.
+    """
+    version = 1
+
+    def __init__(self, path, interval=10):
+        import os
+        self.path = path
+        self.interval = interval
+        self.context = {}           # fit-level information, e.g. stage
+        self.context_arrays = {}
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    def _manifest(self):
+        import os
+        return os.path.join(self.path, "manifest.json")
+
+    def read_manifest(self):
+        """Read manifest of current checkpoint, None if there is none."""
+        import json, os
+        if not os.path.exists(self._manifest()):
+            return None
+        with open(self._manifest()) as fp:
+            manifest = json.load(fp)
+        if manifest["version"] != self.version:
+            raise RuntimeError("checkpoint version %r not supported" % manifest["version"])
+        return manifest
+
+    def save(self, gmm, background, rng, info=None, arrays=None):
+        """Save state of gmm, background, rng, and the context.
+
+        Args:
+            gmm: an instance of GMM
+            background: an instance of Background or None
+            rng: numpy.random.RandomState
+            info (dict): JSON-serializable information to store in manifest
+            arrays (dict): numpy arrays to store
+
+        Returns:
+            None
+        """
+        import json, os, shutil
+        manifest = self.read_manifest()
+        seq = 0 if manifest is None else manifest["seq"] + 1
+        name = "%06d" % seq
+        dirname = os.path.join(self.path, name)
+        if os.path.exists(dirname):
+            shutil.rmtree(dirname)
+        os.makedirs(dirname)
+
+        rng_state = rng.get_state()
+        arrays_ = {"amp": gmm.amp, "mean": gmm.mean, "rng_keys": rng_state[1]}
+        for param in gmm._covar_params:
+            arrays_[param] = getattr(gmm, param)
+        arrays_.update(self.context_arrays)
+        if arrays is not None:
+            arrays_.update(arrays)
+        for key, a in arrays_.items():
+            np.save(os.path.join(dirname, key + ".npy"), a)
+        info_ = dict(self.context)
+        if info is not None:
+            info_.update(info)
+        manifest = {
+            "version": self.version,
+            "seq": seq,
+            "dir": name,
+            "K": gmm.K,
+            "D": gmm.D,
+            "bg_amp": None if background is None else float(background.amp),
+            "rng": [rng_state[0], int(rng_state[2]), int(rng_state[3]), float(rng_state[4])],
+            "arrays": sorted(arrays_.keys()),
+            "info": info_
+        }
+        tmpname = self._manifest() + ".tmp"
+        with open(tmpname, "w") as fp:
+            json.dump(manifest, fp)
+            fp.flush()
+            os.fsync(fp.fileno())
+        getattr(os, "replace", os.rename)(tmpname, self._manifest())
+
+        # remove outdated checkpoints
+        for entry in os.listdir(self.path):
+            if entry != name and entry.isdigit():
+                shutil.rmtree(os.path.join(self.path, entry))
+
+    def load(self, gmm, background, rng):
+        """Load current checkpoint into gmm, background, and rng.
+
+        Returns:
+            info (dict), arrays (dict) or None if there is no checkpoint
+        """
+        import os
+        manifest = self.read_manifest()
+        if manifest is None:
+            return None
+        if manifest["D"] != gmm.D:
+            raise RuntimeError("checkpoint has D=%d, but gmm has D=%d" % (manifest["D"], gmm.D))
+        if (manifest["bg_amp"] is None) != (background is None):
+            raise RuntimeError("checkpoint and background are inconsistent")
+        dirname = os.path.join(self.path, manifest["dir"])
+        arrays = dict((key, np.load(os.path.join(dirname, key + ".npy"), mmap_mode='r')) for key in manifest["arrays"])
+        gmm.amp = np.array(arrays["amp"])
+        gmm.mean = np.array(arrays["mean"])
+        for param in gmm._covar_params:
+            setattr(gmm, param, np.array(arrays[param]))
+        if background is not None:
+            background.amp = manifest["bg_amp"]
+        name, pos, has_gauss, cached_gaussian = manifest["rng"]
+        rng.set_state((name, np.array(arrays["rng_keys"]), pos, has_gauss, cached_gaussian))
+        return manifest["info"], arrays
+
+
+_covariance_types = ['full', 'diag', 'spherical', 'tied', 'lowrank']
+
+# covariance types that are evaluated with diagonal precisions in the E- and
+# M-step, which requires diagonal noise covariances
+_diagonal_types = ['diag', 'spherical', 'lowrank']
+
+# whether all covariances (...,D,D) are diagonal
+def _is_diagonal(covar):
+    return not (covar[..., ~np.eye(covar.shape[-1], dtype='bool')] != 0).any()
+
 class GMM(object):
     """Gaussian mixture model with K components in D dimensions.
 
+    The covariances are stored and fit according to covariance_type:
+        'full': arbitrary covariances, covar (K,D,D)
+        'diag': diagonal covariances, var (K,D)
+        'spherical': isotropic covariances var_k * I, var (K,)
+        'tied': one covariance shared by all components, tied_covar (D,D)
+        'lowrank': covar_k = factor_k factor_k^T + diag(psi_k),
+            with factor (K,D,rank) and psi (K,D)
+    For 'diag', 'spherical', and 'lowrank', the cost to evaluate and fit the
+    model is O(D) or O(D rank^2) instead of O(D^3).
+    Unless covariance_type is 'full', covar is computed from the stored
+    parameters, and it is read-only.
+
     Attributes:
         amp: numpy array (K,), component amplitudes
         mean: numpy array (K,D), component means
         covar: numpy array (K,D,D), component covariances
+        covariance_type (str): one of ['full', 'diag', 'spherical', 'tied', 'lowrank']
+        var: numpy array (K,D) or (K,), component variances (diag, spherical only)
+        tied_covar: numpy array (D,D), shared covariance (tied only)
+        factor: numpy array (K,D,rank), low-rank factors (lowrank only)
+        psi: numpy array (K,D), diagonal variances (lowrank only)
     """
-    def __init__(self, K=0, D=0):
+    def __init__(self, K=0, D=0, covariance_type='full', rank=None):
         """Create the arrays for amp, mean, covar."""
+        if covariance_type not in _covariance_types:
+            raise NotImplementedError("covariance_type %s not in %r" % (covariance_type, _covariance_types))
         self.amp = np.zeros((K))
         self.mean = np.empty((K,D))
-        self.covar = np.empty((K,D,D))
+        self.covariance_type = covariance_type
+        if covariance_type == 'lowrank':
+            if rank is None:
+                raise RuntimeError("covariance_type 'lowrank' needs rank to be set")
+            self.factor = np.empty((K,D,rank))
+            self.psi = np.empty((K,D))
+        elif covariance_type == 'diag':
+            self.var = np.empty((K,D))
+        elif covariance_type == 'spherical':
+            self.var = np.empty((K))
+        elif covariance_type == 'tied':
+            self.tied_covar = np.empty((D,D))
+        else:
+            self.covar = np.empty((K,D,D))
+        self._precision = None
+
+    @property
+    def covar(self):
+        """numpy array (K,D,D): component covariances."""
+        if self.covariance_type == 'full':
+            return self._covar
+        if self.covariance_type == 'tied':
+            return np.broadcast_to(self.tied_covar, (self.K, self.D, self.D))
+        diag = np.arange(self.D)
+        if self.covariance_type == 'lowrank':
+            covar = np.einsum('...ir,...jr', self.factor, self.factor)
+            covar[:, diag, diag] += self.psi
+        else:
+            covar = np.zeros((self.K, self.D, self.D))
+            covar[:, diag, diag] = self._diag_var
+        covar.flags.writeable = False
+        return covar
+
+    @covar.setter
+    def covar(self, covar):
+        if self.covariance_type == 'full':
+            self._covar = covar
+            return
+        K, D = covar.shape[:2]
+        if self.covariance_type == 'lowrank':
+            self.factor = np.empty((K, D, self.rank))
+            self.psi = np.empty((K, D))
+        elif self.covariance_type == 'diag':
+            self.var = np.empty((K, D))
+        elif self.covariance_type == 'spherical':
+            self.var = np.empty((K))
+        self._set_covar(slice(None), covar)
+
+    @property
+    def _diag_var(self):
+        # variances (K,D) of diag and spherical covariances
+        if self.covariance_type == 'spherical':
+            return np.repeat(self.var[:,None], self.D, axis=1)
+        return self.var
+
+    @property
+    def rank(self):
+        """int: rank of the factors for covariance_type 'lowrank', else None."""
+        if self.covariance_type == 'lowrank':
+            return self.factor.shape[2]
+        return None
+
+    @property
+    def _covar_params(self):
+        # names of the arrays that parametrize the covariances
+        if self.covariance_type == 'lowrank':
+            return ('factor', 'psi')
+        if self.covariance_type in ['diag', 'spherical']:
+            return ('var',)
+        if self.covariance_type == 'tied':
+            return ('tied_covar',)
+        return ('covar',)
+
+    def _set_covar(self, k, covar):
+        # set covariances of components k, projected onto the parametrization:
+        # diag: diagonal, spherical: mean variance, tied: mean covariance
+        # (of the given covariances, which then holds for all components).
+        # lowrank: the variance along the rank largest principal axes is split
+        # evenly between factor and psi, which keeps psi > 0, and factor away
+        # from 0, a fixed point of the factor update.
+        if self.covariance_type == 'full':
+            self.covar[k] = covar
+        elif self.covariance_type == 'diag':
+            self.var[k] = np.diagonal(covar, axis1=-2, axis2=-1)
+        elif self.covariance_type == 'spherical':
+            self.var[k] = np.trace(covar, axis1=-2, axis2=-1) / self.D
+        elif self.covariance_type == 'tied':
+            self.tied_covar[:,:] = covar if np.ndim(covar) == 2 else np.mean(covar, axis=0)
+        else:
+            val, vec = np.linalg.eigh(covar)
+            r = self.rank
+            factor = vec[...,-r:] * np.sqrt(np.maximum(val[...,None,-r:], 0) / 2)
+            self.factor[k] = factor
+            self.psi[k] = np.diagonal(covar, axis1=-2, axis2=-1) - (factor**2).sum(axis=-1)
 
     @property
     def K(self):
@@ -217,23 +497,47 @@ class GMM(object):
         Returns:
             None
         """
-        np.savez(filename, amp=self.amp, mean=self.mean, covar=self.covar, **kwargs)
+        params = dict((name, getattr(self, name)) for name in self._covar_params)
+        if self.covariance_type != 'full':
+            params['covariance_type'] = self.covariance_type
+        np.savez(filename, amp=self.amp, mean=self.mean, **dict(params, **kwargs))
 
-    def load(self, filename):
+    def load(self, filename, name=None):
         """Load GMM from file.
 
         Additional arguments stored by save() will be ignored.
 
+        Files created with save_bank() are memory-mapped, the parameter arrays
+        are then read-only.
+
         Args:
-            filename (str): name for file create with save().
+            filename (str): name for file create with save() or save_bank().
+            name (str): name of the model in a file created with save_bank(),
+                can be omitted if the file holds a single model
 
         Returns:
             None
         """
+        if _is_bank(filename):
+            bank = ModelBank(filename)
+            if name is None:
+                if len(bank) != 1:
+                    raise RuntimeError("name needs to be set for file with %d models" % len(bank))
+                name = bank.names()[0]
+            gmm = bank[name]
+            self.covariance_type = gmm.covariance_type
+            self.amp, self.mean = gmm.amp, gmm.mean
+            for param in gmm._covar_params:
+                setattr(self, param, getattr(gmm, param))
+            self._precision = gmm._precision
+            return
         F = np.load(filename)
         self.amp = F["amp"]
         self.mean = F["mean"]
-        self.covar = F["covar"]
+        self.covariance_type = str(F["covariance_type"]) if "covariance_type" in F.files else 'full'
+        for name in self._covar_params:
+            setattr(self, name, F[name])
+        self._precision = None
         F.close()
 
     def draw(self, size=1, rng=np.random):
@@ -255,7 +559,13 @@ class GMM(object):
         lower = 0
         for k in np.flatnonzero(N):
             upper = lower + N[k]
-            samples[lower:upper, :] = rng.multivariate_normal(self.mean[k], self.covar[k], size=N[k])
+            if self.covariance_type == 'lowrank':
+                z = rng.normal(size=(N[k], self.rank + self.D))
+                samples[lower:upper, :] = self.mean[k] + np.dot(z[:,:self.rank], self.factor[k].T) + z[:,self.rank:] * np.sqrt(self.psi[k])
+            elif self.covariance_type in ['diag', 'spherical']:
+                samples[lower:upper, :] = self.mean[k] + rng.normal(size=(N[k], self.D)) * np.sqrt(self.var[k])
+            else:
+                samples[lower:upper, :] = rng.multivariate_normal(self.mean[k], self.covar[k], size=N[k])
             lower = upper
         return samples
 
@@ -277,17 +587,20 @@ class GMM(object):
         else:
             return np.exp(self.logL(coords, covar=covar))
 
-    def _mp_chunksize(self):
+    def _mp_chunksize(self, processes=None):
         # find how many components to distribute over available threads
-        import multiprocessing
-        cpu_count = multiprocessing.cpu_count()
+        if processes is None:
+            import multiprocessing
+            cpu_count = multiprocessing.cpu_count()
+        else:
+            cpu_count = processes
         chunksize = max(1, self.K//cpu_count)
         n_chunks = min(cpu_count, self.K//chunksize)
         return n_chunks, chunksize
 
-    def _get_chunks(self):
+    def _get_chunks(self, processes=None):
         # split all component in ideal-sized chunks
-        n_chunks, chunksize = self._mp_chunksize()
+        n_chunks, chunksize = self._mp_chunksize(processes)
         left = self.K - n_chunks*chunksize
         chunks = []
         n = 0
@@ -299,10 +612,11 @@ class GMM(object):
             n = n_
         return chunks
 
-    def logL(self, coords, covar=None):
+    def logL(self, coords, covar=None, covar_index=None, pool=None, processes=None):
         """Log-likelihood of coords given all (i.e. the sum of) GMM components
 
-        Distributes computation over all threads on the machine.
+        Distributes computation over all threads on the machine, or over the
+        given pool.
 
         If covar is None, this method returns
             log(sum_k(p(x | k)))
@@ -310,60 +624,792 @@ class GMM(object):
             log(sum_k(p(y | k))),
         where y = x + noise and noise ~ N(0, covar).
 
+        If covar_index is set, covar is a table of C unique covariances, and
+        sample i has covariance covar[covar_index[i]]. Per-sample covariances
+        with only few unique entries are converted to such a table.
+
         Args:
             coords: numpy array (D,) or (N, D) of test coordinates
-            covar:  numpy array (D, D) or (N, D, D) covariance matrix of coords
+            covar:  numpy array (D, D), (N, D, D), or (C, D, D) covariance matrix of coords
+            covar_index: numpy array (N,) of indices into covar
+            pool: multiprocessing.Pool to use, will be created if None
+            processes (int): number of processes to use, defaults to all
 
         Returns:
             numpy array (1,) or (N, 1) log(L), depending on shape of data
         """
+        if covar_index is None and covar is not None and np.ndim(coords) == 2 and covar.shape != (self.D, self.D):
+            table, index = _unique_covar(covar)
+            if table is not None:
+                covar, covar_index = table, index
+
         # Instead log p (x | k) for each k (which is huge)
         # compute it in stages: first for each chunk, then sum over all chunks
-        import multiprocessing
-        pool = multiprocessing.Pool()
-        chunks = self._get_chunks()
-        results = [pool.apply_async(self._logsum_chunk, (chunk, coords, covar)) for chunk in chunks]
+        own_pool = pool is None
+        if own_pool:
+            import multiprocessing
+            pool = multiprocessing.Pool(processes=processes)
+        chunks = self._get_chunks(processes)
+        results = [pool.apply_async(self._logsum_chunk, (chunk, coords, covar, covar_index)) for chunk in chunks]
         log_p_y_chunk = []
         for r in results:
             log_p_y_chunk.append(r.get())
-        pool.close()
+        if own_pool:
+            pool.close()
         return logsum(np.array(log_p_y_chunk)) # sum over all chunks = all k
 
-    def _logsum_chunk(self, chunk, coords, covar=None):
+    def _logsum_chunk(self, chunk, coords, covar=None, covar_index=None):
         # helper function to reduce the memory requirement of logL
         log_p_y_k = np.empty((chunk[1]-chunk[0], len(coords)))
         for i in xrange(chunk[1] - chunk[0]):
             k = chunk[0] + i
-            log_p_y_k[i,:] = self.logL_k(k, coords, covar=covar)
+            log_p_y_k[i,:] = self.logL_k(k, coords, covar=covar, covar_index=covar_index)
         return logsum(log_p_y_k)
 
-    def logL_k(self, k, coords, covar=None, chi2_only=False):
+    def logL_k(self, k, coords, covar=None, covar_index=None, chi2_only=False):
         """Log-likelihood of coords given only component k.
 
         Args:
             k (int): component index
             coords: numpy array (D,) or (N, D) of test coordinates
-            covar:  numpy array (D, D) or (N, D, D) covariance matrix of coords
+            covar:  numpy array (D, D), (N, D, D), or (C, D, D) covariance matrix of coords
+            covar_index: numpy array (N,) of indices into covar
             chi2_only (bool): only compute deltaX^T Sigma_k^-1 deltaX
 
         Returns:
             numpy array (1,) or (N, 1) log(L), depending on shape of data
         """
-        # compute p(x | k)
+        chi2, log_norm = self._chi2_k(k, coords, covar=covar, covar_index=covar_index, norm=not chi2_only)
+        if chi2_only:
+            return chi2
+        return log_norm - chi2/2
+
+    def _chi2_k(self, k, coords, covar=None, covar_index=None, norm=True):
+        # compute chi2 of coords wrt component k,
+        # and if norm: log of amp_k times the normalization of p(x | k)
         dx = coords - self.mean[k]
+        if self.covariance_type in _diagonal_types and (covar is None or _is_diagonal(covar)):
+            # only diagonal noise keeps the structure of the covariances,
+            # otherwise T_k = covar_k + covar is evaluated as full matrix
+            var = 0
+            if covar is not None:
+                var = np.diagonal(covar, axis1=-2, axis2=-1)
+                if covar_index is not None:
+                    var = var[covar_index]
+            if self.covariance_type == 'lowrank':
+                chi2, logdet, _ = _woodbury(self.factor[k], 1 / (self.psi[k] + var), dx)
+            else:
+                T_k = self._diag_var[k] + var
+                chi2 = np.einsum('...i,...i', dx**2, 1 / T_k)
+                logdet = np.log(T_k).sum(axis=-1)
+            if not norm:
+                return chi2, None
+            log2piD2 = np.log(2*np.pi)*(0.5*self.D)
+            return chi2, np.log(self.amp[k]) - log2piD2 - logdet/2
+        if covar_index is not None:
+            # covar is a table of unique covariances: invert T once per entry
+            chi2 = np.empty(len(dx))
+            logdet = np.empty(len(dx))
+            C_k = self.covar[k]
+            for c, sel in zip(*_groupby(covar_index)):
+                T_k = C_k + covar[c]
+                dx_ = dx[sel]
+                chi2[sel] = np.einsum('...i,...i', np.dot(dx_, np.linalg.inv(T_k)), dx_)
+                logdet[sel] = np.linalg.slogdet(T_k)[1]
+            if not norm:
+                return chi2, None
+            log2piD2 = np.log(2*np.pi)*(0.5*self.D)
+            return chi2, np.log(self.amp[k]) - log2piD2 - logdet/2
         if covar is None:
+            precision = self._cached_precision()
+            if precision is not None:
+                # chi2 = |dx^T P_k|^2 with P_k P_k^T = covar_k^-1
+                y = np.dot(dx, precision[0][k])
+                return np.einsum('...i,...i', y, y), precision[1][k]
             T_k = self.covar[k]
         else:
             T_k = self.covar[k] + covar
         chi2 = np.einsum('...i,...ij,...j', dx, np.linalg.inv(T_k), dx)
-
-        if chi2_only:
-            return chi2
+        if not norm:
+            return chi2, None
 
         # prevent tiny negative determinants to mess up
         (sign, logdet) = np.linalg.slogdet(T_k)
         log2piD2 = np.log(2*np.pi)*(0.5*self.D)
-        return np.log(self.amp[k]) - log2piD2 - sign*logdet/2 - chi2/2
+        return chi2, np.log(self.amp[k]) - log2piD2 - sign*logdet/2
+
+    def _sample_chunks(self, N, processes=None):
+        # split N samples in chunks for all processes,
+        # and small enough to keep the (chunk, K) arrays in memory
+        if processes is None:
+            import multiprocessing
+            processes = multiprocessing.cpu_count()
+        size = min(-(-N // processes), max(1, 2**22 // max(1, self.K)))
+        return [(n, min(n + size, N)) for n in xrange(0, N, size)]
+
+    def responsibilities(self, coords, covar=None, top=None, cutoff=None, pool=None, processes=None):
+        """Posterior probabilities of the components for each sample.
+
+        Distributes chunks of samples over all threads on the machine, or over
+        the given pool.
+
+        Args:
+            coords: numpy array (D,) or (N, D) of test coordinates
+            covar:  numpy array (D, D) or (N, D, D) covariance matrix of coords
+            top (int): if set, only return the top largest responsibilities
+            cutoff (float): size of component neighborhood [in 1D equivalent
+                sigmas], components are ignored for samples outside of it
+            pool: multiprocessing.Pool to use, will be created if None
+            processes (int): number of processes to use, defaults to all
+
+        Returns:
+            numpy array (N, K) of responsibilities if top is None, otherwise
+            numpy arrays (N, top) of component indices and (N, top) of their
+            responsibilities, in decreasing order. Responsibilities are
+            normalized over all components, samples outside of the cutoff of
+            every component have zero responsibilities.
+        """
+        coords_ = np.atleast_2d(coords)
+        N = len(coords_)
+        per_sample = covar is not None and covar.shape != (self.D, self.D)
+        if cutoff is not None:
+            cutoff = chi2_cutoff(self.D, cutoff=cutoff)
+        if top is not None:
+            top = min(top, self.K)
+
+        own_pool = pool is None
+        if own_pool:
+            import multiprocessing
+            pool = multiprocessing.Pool(processes=processes)
+        chunks = self._sample_chunks(N, processes)
+        results = [pool.apply_async(self._responsibilities_chunk, (coords_[i:j], covar[i:j] if per_sample else covar, top, cutoff)) for i,j in chunks]
+        results = [r.get() for r in results]
+        if own_pool:
+            pool.close()
+
+        if top is None:
+            q = np.concatenate(results)
+            return q[0] if np.ndim(coords) == 1 else q
+        index = np.concatenate([r[0] for r in results])
+        q = np.concatenate([r[1] for r in results])
+        if np.ndim(coords) == 1:
+            return index[0], q[0]
+        return index, q
+
+    def _responsibilities_chunk(self, coords, covar=None, top=None, cutoff=None):
+        # helper function of responsibilities, operates on a chunk of samples
+        log_q = np.empty((len(coords), self.K))
+        for k in xrange(self.K):
+            chi2, log_norm = self._chi2_k(k, coords, covar=covar)
+            log_q[:,k] = log_norm - chi2/2
+            if cutoff is not None:
+                log_q[chi2 > cutoff, k] = -np.inf
+        # samples without any component in their vicinity get q = 0
+        H = np.isfinite(log_q).any(axis=1)
+        log_q[H] -= logsum(log_q[H], axis=1)[:,None]
+        q = np.exp(log_q)
+        if top is None:
+            return q
+        rows = np.arange(len(coords))[:,None]
+        index = np.argpartition(-q, top-1, axis=1)[:,:top]
+        index = index[rows, np.argsort(-q[rows, index], axis=1)]
+        return index, q[rows, index]
+
+    def predict(self, coords, covar=None, cutoff=None, pool=None, processes=None):
+        """Component with the largest responsibility for each sample.
+
+        See responsibilities() for details.
+
+        Args:
+            coords: numpy array (D,) or (N, D) of test coordinates
+            covar:  numpy array (D, D) or (N, D, D) covariance matrix of coords
+            cutoff (float): size of component neighborhood [in 1D equivalent
+                sigmas], components are ignored for samples outside of it
+            pool: multiprocessing.Pool to use, will be created if None
+            processes (int): number of processes to use, defaults to all
+
+        Returns:
+            numpy array (N,) of component indices, -1 if there is no component
+            within cutoff
+        """
+        index, q = self.responsibilities(coords, covar=covar, top=1, cutoff=cutoff, pool=pool, processes=processes)
+        return np.where(q[...,0] > 0, index[...,0], -1)
+
+    def grid(self, axes, covar=None, cutoff=5, out=None):
+        """Evaluate model PDF on a regular grid.
+
+        Each component is only evaluated within the bounding box of its
+        cutoff ellipsoid, the coordinates of the grid points are never
+        created.
+
+        Args:
+            axes: list of D sorted numpy arrays, the coordinates of the grid
+                along each dimension
+            covar: numpy array (D, D) covariance matrix of the grid points
+            cutoff (float): size of component neighborhood [in 1D equivalent
+                sigmas], outside of which its PDF is neglected
+            out: numpy array to add the PDF to, will be created if None
+
+        Returns:
+            numpy array (len(axes[0]), ..., len(axes[D-1])) of PDF, indexed as
+            numpy.meshgrid(*axes, indexing='ij')
+        """
+        if len(axes) != self.D:
+            raise RuntimeError("need %d axes for grid" % self.D)
+        axes = [np.asarray(axis, dtype='float64') for axis in axes]
+        shape = tuple(axis.size for axis in axes)
+        if out is None:
+            out = np.zeros(shape)
+        elif out.shape != shape:
+            raise RuntimeError("out has shape %r, need %r" % (out.shape, shape))
+        chi2_cut = chi2_cutoff(self.D, cutoff=cutoff)
+
+        covar_ = self.covar
+        for k in xrange(self.K):
+            T_k = covar_[k] if covar is None else covar_[k] + covar
+            # bounding box of chi2 < chi2_cut: mean +- sqrt(chi2_cut T_dd)
+            width = np.sqrt(chi2_cut * np.diagonal(T_k))
+            box = []
+            for d, axis in enumerate(axes):
+                lower = np.searchsorted(axis, self.mean[k,d] - width[d], side='left')
+                upper = np.searchsorted(axis, self.mean[k,d] + width[d], side='right')
+                box.append(slice(lower, upper))
+            if any(b.start >= b.stop for b in box):
+                continue
+
+            # chi2 from offsets along each axis, broadcast over the box
+            dx = []
+            for d, axis in enumerate(axes):
+                shape_d = [1] * self.D
+                shape_d[d] = -1
+                dx.append((axis[box[d]] - self.mean[k,d]).reshape(shape_d))
+            T_inv = np.linalg.inv(T_k)
+            chi2 = 0
+            for d in xrange(self.D):
+                chi2 = chi2 + T_inv[d,d] * dx[d]**2
+                for e in xrange(d):
+                    chi2 = chi2 + 2 * T_inv[d,e] * dx[d] * dx[e]
+            (sign, logdet) = np.linalg.slogdet(T_k)
+            log2piD2 = np.log(2*np.pi)*(0.5*self.D)
+            p = np.exp(np.log(self.amp[k]) - log2piD2 - sign*logdet/2 - chi2/2)
+            p[chi2 >= chi2_cut] = 0
+            out[tuple(box)] += p
+        return out
+
+    def index(self, eps=None, covar=None):
+        """Spatial index of the components for fast evaluation of logL.
+
+        See ComponentIndex for details.
+
+        Args:
+            eps (float): bound on the absolute error of the PDF
+            covar:  numpy array (D, D) covariance matrix of the query points
+
+        Returns:
+            ComponentIndex
+        """
+        return ComponentIndex(self, eps=eps, covar=covar)
+
+    def marginalize(self, dims):
+        """Marginal distribution of the given dimensions.
+
+        Args:
+            dims: list of dimension indices to keep
+
+        Returns:
+            GMM with K components in len(dims) dimensions
+        """
+        dims = np.atleast_1d(dims)
+        gmm = GMM(K=self.K, D=dims.size)
+        gmm.amp[:] = self.amp
+        gmm.mean[:,:] = self.mean[:,dims]
+        gmm.covar[:,:,:] = self.covar[:,dims][:,:,dims]
+        return gmm
+
+    def condition(self, dims):
+        """Distribution of the other dimensions, conditioned on dims.
+
+        The regression matrices and conditional covariances of all components
+        are computed once, the returned object can then be evaluated for many
+        values of the conditioning dimensions.
+
+        Args:
+            dims: list of dimension indices to condition on
+
+        Returns:
+            ConditionalGMM
+        """
+        return ConditionalGMM(self, dims)
+
+    @classmethod
+    def _from_arrays(cls, amp, mean, covar):
+        # GMM with given parameter arrays, no copies
+        gmm = cls()
+        gmm.amp, gmm.mean, gmm.covar = amp, mean, covar
+        return gmm
+
+    def _cached_precision(self):
+        # precision Cholesky factors and log-normalizations stored by
+        # save_bank(), valid as long as the parameters are the same read-only
+        # arrays they were loaded with
+        precision = getattr(self, "_precision", None)
+        if precision is None:
+            return None
+        amp, mean, covar, prec_chol, log_norm = precision
+        if amp is self.amp and mean is self.mean and covar is self.covar:
+            return prec_chol, log_norm
+        return None
+
+
+class ComponentIndex(object):
+    """Spatial index of GMM components.
+
+    For a query point x, component k is ignored if its chi2 exceeds c_k,
+    which is set such that amp_k N(x | mean_k, covar_k) < eps / K. The PDF
+    of the GMM is thus computed with an absolute error of at most eps.
+
+    The ellipsoids chi2 < c_k are bounded by spheres, whose centers are
+    stored in KD-trees, one for each range of radii within a factor of 2.
+    A query only evaluates the components whose sphere contains the point.
+
+    Attributes:
+        eps (float): bound on the absolute error of the PDF
+        chi2_max: numpy array (K,), chi2 beyond which components are ignored
+        radius: numpy array (K,), radius of the bounding spheres
+    """
+    def __init__(self, gmm, eps=None, covar=None):
+        """Create index of gmm components.
+
+        Args:
+            gmm: an instance of GMM
+            eps (float): bound on the absolute error of the PDF, defaults to
+                1e-10 of the largest peak value of any component
+            covar:  numpy array (D, D) covariance matrix of the query points
+        """
+        from scipy.spatial import cKDTree
+        if covar is not None and np.shape(covar) != (gmm.D, gmm.D):
+            raise NotImplementedError("ComponentIndex only supports one covar for all query points")
+        self.D = gmm.D
+        self.K = gmm.K
+        self.mean = gmm.mean.copy()
+        covar_ = gmm.covar if covar is None else gmm.covar + covar
+        self._prec_chol, self._log_norm = _precision_cholesky(GMM._from_arrays(gmm.amp, gmm.mean, covar_))
+        if eps is None:
+            eps = 1e-10 * np.exp(self._log_norm.max())
+        self.eps = eps
+        # amp_k N_k(x) < eps/K <=> chi2 > 2 (log_norm_k - log(eps/K))
+        self.chi2_max = 2 * (self._log_norm - np.log(eps / self.K))
+        self.radius = np.sqrt(np.maximum(self.chi2_max, 0) * np.linalg.eigvalsh(covar_)[:,-1])
+
+        # components whose peak is below eps/K are always ignored
+        relevant = np.flatnonzero(self.chi2_max > 0)
+        self._trees = []
+        if relevant.size:
+            bucket = np.floor(np.log2(self.radius[relevant]))
+            for b in np.unique(bucket):
+                ks = relevant[bucket == b]
+                self._trees.append((cKDTree(self.mean[ks]), ks, self.radius[ks].max()))
+
+    def query(self, coords):
+        """Components that need to be evaluated for each point.
+
+        Args:
+            coords: numpy array (N, D) of query coordinates
+
+        Returns:
+            numpy arrays (M,) of point indices and (M,) of component indices
+            of all M relevant pairs, ordered by point index
+        """
+        from scipy.spatial import cKDTree
+        coords = np.atleast_2d(coords)
+        points, components = [], []
+        coords_tree = cKDTree(coords)
+        for tree, ks, radius in self._trees:
+            pairs = coords_tree.sparse_distance_matrix(tree, radius, output_type='ndarray')
+            if pairs.size == 0:
+                continue
+            points.append(pairs['i'])
+            components.append(ks[pairs['j']])
+        if len(points) == 0:
+            return np.zeros(0, dtype='int'), np.zeros(0, dtype='int')
+        points = np.concatenate(points)
+        components = np.concatenate(components)
+        order = np.argsort(points, kind='mergesort')
+        return points[order], components[order]
+
+    def logL(self, coords, chunksize=10000):
+        """Log-likelihood of coords given all GMM components.
+
+        Args:
+            coords: numpy array (D,) or (N, D) of query coordinates
+            chunksize (int): number of points to process at once
+
+        Returns:
+            numpy array (1,) or (N, 1) log(L), depending on shape of data.
+            Points without relevant component have log(L) = -inf.
+        """
+        coords_ = np.atleast_2d(coords)
+        N = len(coords_)
+        log_L = np.empty(N)
+        for start in xrange(0, N, chunksize):
+            stop = min(start + chunksize, N)
+            log_L[start:stop] = self._logL_chunk(coords_[start:stop])
+        if np.ndim(coords) == 1:
+            return log_L[0]
+        return log_L
+
+    def _logL_chunk(self, coords):
+        points, components = self.query(coords)
+        dx = coords[points] - self.mean[components]
+        y = np.einsum('ni,nij->nj', dx, self._prec_chol[components])
+        chi2 = np.einsum('ni,ni->n', y, y)
+        # ellipsoidal bound
+        sel = chi2 < self.chi2_max[components]
+        points = points[sel]
+        log_p = self._log_norm[components[sel]] - chi2[sel]/2
+
+        # logsum over components of each point
+        log_L = np.empty(len(coords))
+        log_L[:] = -np.inf
+        if points.size:
+            starts = np.flatnonzero(np.r_[True, points[1:] != points[:-1]])
+            log_max = np.maximum.reduceat(log_p, starts)
+            p = np.exp(log_p - np.repeat(log_max, np.diff(np.r_[starts, points.size])))
+            log_L[points[starts]] = log_max + np.log(np.add.reduceat(p, starts))
+        return log_L
+
+
+class ConditionalGMM(object):
+    """GMM of the free dimensions y, conditioned on values x of dims.
+
+    For component k, p(y | x, k) is normal with mean
+        mean_y[k] + B[k] (x - mean_x[k])
+    and covariance covar[k], and component k has the weight
+        amp[k] N(x | mean_x[k], covar_xx[k]) / sum_j amp[j] N(x | mean_x[j], covar_xx[j])
+
+    Attributes:
+        dims: numpy array of the conditioning dimensions
+        free: numpy array of the free dimensions
+        marginal: GMM of the conditioning dimensions
+        B: numpy array (K, len(free), len(dims)), regression matrices
+        mean: numpy array (K, len(free)), means of the free dimensions
+        covar: numpy array (K, len(free), len(free)), conditional covariances
+    """
+    def __init__(self, gmm, dims):
+        """Compute regression matrices and conditional covariances of gmm."""
+        self.dims = np.atleast_1d(dims)
+        self.free = np.setdiff1d(np.arange(gmm.D), self.dims)
+        if self.free.size == 0:
+            raise RuntimeError("cannot condition on all dimensions")
+        self.marginal = gmm.marginalize(self.dims)
+        covar_yx = gmm.covar[:,self.free][:,:,self.dims]
+        # B_k = Sigma_yx Sigma_xx^-1, Sigma_y|x = Sigma_yy - B_k Sigma_xy
+        self.B = np.einsum('...ij,...jk', covar_yx, np.linalg.inv(self.marginal.covar))
+        self.mean = gmm.mean[:,self.free]
+        self.covar = gmm.covar[:,self.free][:,:,self.free] - np.einsum('...ij,...kj', self.B, covar_yx)
+        self._marginal_precision = _precision_cholesky(self.marginal)
+        self._chol = np.linalg.cholesky(self.covar)
+        self._covar_precision = _precision_cholesky(GMM._from_arrays(np.ones(gmm.K), self.mean, self.covar))
+
+    @property
+    def K(self):
+        """int: number of components."""
+        return self.B.shape[0]
+
+    @property
+    def D(self):
+        """int: number of free dimensions."""
+        return self.free.size
+
+    def _log_weights(self, x):
+        # log of component weights given x, numpy array (N, K)
+        x = np.atleast_2d(x)
+        prec_chol, log_norm = self._marginal_precision
+        dx = x[:,None,:] - self.marginal.mean[None,:,:]
+        y = np.einsum('nki,kij->nkj', dx, prec_chol)
+        log_w = log_norm[None,:] - np.einsum('nki,nki->nk', y, y)/2
+        return log_w - logsum(log_w, axis=1)[:,None]
+
+    def weights(self, x):
+        """Component weights given x.
+
+        Args:
+            x: numpy array (len(dims),) or (N, len(dims))
+
+        Returns:
+            numpy array (N, K)
+        """
+        return np.exp(self._log_weights(x))
+
+    def means(self, x):
+        """Component means of the free dimensions given x.
+
+        Args:
+            x: numpy array (len(dims),) or (N, len(dims))
+
+        Returns:
+            numpy array (N, K, len(free))
+        """
+        x = np.atleast_2d(x)
+        dx = x[:,None,:] - self.marginal.mean[None,:,:]
+        return self.mean[None,:,:] + np.einsum('kij,nkj->nki', self.B, dx)
+
+    def expectation(self, x):
+        """Mean of the free dimensions given x.
+
+        Args:
+            x: numpy array (len(dims),) or (N, len(dims))
+
+        Returns:
+            numpy array (N, len(free))
+        """
+        return np.einsum('nk,nki->ni', self.weights(x), self.means(x))
+
+    def logL(self, y, x):
+        """Log-likelihood of y given x.
+
+        Args:
+            y: numpy array (len(free),) or (N, len(free))
+            x: numpy array (len(dims),) or (N, len(dims))
+
+        Returns:
+            numpy array (N,)
+        """
+        prec_chol, log_norm = self._covar_precision
+        dy = np.atleast_2d(y)[:,None,:] - self.means(x)
+        z = np.einsum('nki,kij->nkj', dy, prec_chol)
+        log_p = self._log_weights(x) + log_norm[None,:] - np.einsum('nki,nki->nk', z, z)/2
+        return logsum(log_p, axis=1)
+
+    def draw(self, x, rng=np.random):
+        """Draw one sample of the free dimensions for each x.
+
+        Args:
+            x: numpy array (len(dims),) or (N, len(dims))
+            rng: numpy.random.RandomState for deterministic draw
+
+        Returns:
+            numpy array (N, len(free))
+        """
+        w = self.weights(x)
+        N = len(w)
+        # inverse transform sampling of the component for each x
+        k = (w.cumsum(axis=1) < rng.rand(N)[:,None]).sum(axis=1)
+        k = np.minimum(k, self.K - 1)
+        z = rng.normal(size=(N, self.D))
+        return self.means(x)[np.arange(N), k] + np.einsum('nij,nj->ni', self._chol[k], z)
+
+    def gmm(self, x):
+        """GMM of the free dimensions for a single x.
+
+        Args:
+            x: numpy array (len(dims),)
+
+        Returns:
+            GMM with K components in len(free) dimensions
+        """
+        return GMM._from_arrays(self.weights(x)[0], self.means(x)[0], self.covar.copy())
+
+
+# binary format of save_bank(): magic bytes, size of JSON header (uint64),
+# JSON header, then the arrays, each aligned to _bank_align bytes from the
+# start of the data section
+_bank_magic = b"\x93GMMBANK"
+_bank_version = 2
+_bank_align = 64
+
+def _precision_cholesky(gmm):
+    # P_k = (C_k^-1)^T with C_k C_k^T = covar_k, so that P_k P_k^T = covar_k^-1,
+    # and log of amp_k N(x | mu_k, covar_k) up to chi2
+    C = np.linalg.cholesky(gmm.covar)
+    prec_chol = np.linalg.inv(C).swapaxes(-1, -2)
+    log_norm = np.log(gmm.amp) - np.log(2*np.pi)*(0.5*gmm.D) - np.log(np.diagonal(C, axis1=-2, axis2=-1)).sum(axis=-1)
+    return prec_chol, log_norm
+
+def _is_bank(filename):
+    with open(filename, "rb") as fp:
+        return fp.read(len(_bank_magic)) == _bank_magic
+
+def save_bank(filename, gmms, precision=True):
+    """Save GMMs to a binary file, which can be memory-mapped.
+
+    Args:
+        filename (str): name for saved file
+        gmms (dict): instances of GMM by name
+        precision (bool): whether to store Cholesky factors of the precision
+            matrices and log-normalizations of the components to speed up
+            GMM.logL() without noise, only for covariance_type 'full'
+
+    Returns:
+        None
+    """
+    import json, struct
+    models = {}
+    blocks = []
+    offset = 0
+    for name, gmm in gmms.items():
+        arrays = {"amp": gmm.amp, "mean": gmm.mean}
+        for param in gmm._covar_params:
+            arrays[param] = getattr(gmm, param)
+        if precision and gmm.covariance_type == 'full':
+            arrays["prec_chol"], arrays["log_norm"] = _precision_cholesky(gmm)
+        entry = {"covariance_type": gmm.covariance_type}
+        for key, a in arrays.items():
+            a = np.ascontiguousarray(a, dtype='<f8')
+            offset = -(-offset // _bank_align) * _bank_align
+            entry[key] = {"offset": offset, "shape": list(a.shape)}
+            blocks.append((offset, a))
+            offset += a.nbytes
+        models[str(name)] = entry
+    header = json.dumps({"version": _bank_version, "dtype": "<f8", "models": models}).encode("utf-8")
+    start = -(-(len(_bank_magic) + 8 + len(header)) // _bank_align) * _bank_align
+    end = start + offset
+    with open(filename, "wb") as fp:
+        fp.write(_bank_magic)
+        fp.write(struct.pack("<Q", len(header)))
+        fp.write(header)
+        for offset, a in blocks:
+            fp.seek(start + offset)
+            fp.write(a.tobytes())
+        fp.truncate(end)
+
+
+class ModelBank(object):
+    """Collection of GMMs in a file created by save_bank().
+
+    The file is memory-mapped once, each GMM is created on request with
+    read-only parameter arrays backed by the file, so that only the pages
+    of the models in use are read.
+    """
+    def __init__(self, filename):
+        """Read the header of filename."""
+        import json, struct
+        with open(filename, "rb") as fp:
+            if fp.read(len(_bank_magic)) != _bank_magic:
+                raise RuntimeError("%s is not a model bank" % filename)
+            size = struct.unpack("<Q", fp.read(8))[0]
+            header = json.loads(fp.read(size).decode("utf-8"))
+        if header["version"] > _bank_version:
+            raise RuntimeError("model bank version %r not supported" % header["version"])
+        self.filename = filename
+        self._dtype = np.dtype(header["dtype"])
+        self._models = header["models"]
+        self._start = -(-(len(_bank_magic) + 8 + size) // _bank_align) * _bank_align
+        self._mmap = None
+
+    def __len__(self):
+        return len(self._models)
+
+    def __contains__(self, name):
+        return name in self._models
+
+    def __iter__(self):
+        return iter(self._models)
+
+    def names(self):
+        """list: names of all models."""
+        return list(self._models.keys())
+
+    def _array(self, entry):
+        shape = tuple(entry["shape"])
+        count = int(np.prod(shape))
+        return np.frombuffer(self._mmap, dtype=self._dtype, count=count, offset=self._start + entry["offset"]).reshape(shape)
+
+    def __getitem__(self, name):
+        """Get GMM of given name."""
+        entry = self._models[name]
+        if self._mmap is None:
+            self._mmap = np.memmap(self.filename, dtype='uint8', mode='r')
+        gmm = GMM()
+        gmm.covariance_type = entry.get("covariance_type", "full")
+        gmm.amp = self._array(entry["amp"])
+        gmm.mean = self._array(entry["mean"])
+        for param in gmm._covar_params:
+            setattr(gmm, param, self._array(entry[param]))
+        if "prec_chol" in entry:
+            gmm._precision = (gmm.amp, gmm.mean, gmm.covar, self._array(entry["prec_chol"]), self._array(entry["log_norm"]))
+        return gmm
+
+
+class FitMetrics(object):
+    """Record of timings and diagnostics of a fit.
+
+    Pass an instance to fit(), which fills it during the fit. Each EM
+    iteration adds a dictionary to iterations with the keys
+        prefix, iter: identifier of the EM sequence and the iteration
+        E, M, update: time [s] for E-step, M-step, and parameter update
+        draw, selection, imputation: time [s] for drawing imputation samples
+            (including the selection), for sel_callback alone, and for E- and
+            M-step of the imputation samples
+        total: time [s] of the whole iteration
+        samples: number of samples, which changes between the stages of
+            multi-resolution fits
+        log_L: mean log-likelihood
+        moved: number of components that moved
+        dormant: number of automatically frozen components
+        neighborhood: numpy array (K,) of neighborhood sizes
+        rejected: whether SQUAREM extrapolation was rejected
+        rss_max: high-water mark of memory of this process [kB]
+
+    Attributes:
+        iterations: list of dictionaries, one per EM iteration
+        pool_setup (float): time [s] to set up the pool
+        split_n_merge: list of dictionaries, one per split'n'merge attempt,
+            with keys time [s] (to find and update components), changing
+            (component indices), and accepted
+        callback: function called with each iteration's dictionary
+    """
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.iterations = []
+        self.pool_setup = 0
+        self.split_n_merge = []
+        self._current = None
+
+    @property
+    def log_L(self):
+        """numpy array: trace of the mean log-likelihood."""
+        return np.array([record["log_L"] for record in self.iterations])
+
+    def _start(self, prefix, it):
+        self._current = {"prefix": prefix, "iter": it, "E": 0., "M": 0., "draw": 0., "selection": 0., "imputation": 0., "update": 0.}
+        self._t0 = time.time()
+        return self._t0
+
+    def _lap(self, phase, t0):
+        # add time since t0 to phase, return current time
+        t = time.time()
+        self._current[phase] += t - t0
+        return t
+
+    def _timed(self, func, phase):
+        # wrap func to add its execution time to phase
+        def timed(*args, **kwargs):
+            t0 = time.time()
+            result = func(*args, **kwargs)
+            self._lap(phase, t0)
+            return result
+        return timed
+
+    def _finish(self, U=None, N=0, dormant=None, **kwargs):
+        record = self._current
+        record["total"] = time.time() - self._t0
+        record.update(kwargs)
+        record.setdefault("rejected", False)
+        record["samples"] = N
+        if U is not None:
+            record["neighborhood"] = np.array([N if U_k is None else len(U_k) for U_k in U])
+        record["dormant"] = 0 if dormant is None else int(dormant.sum())
+        try:
+            import resource
+            record["rss_max"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        except ImportError:
+            record["rss_max"] = None
+        self.iterations.append(record)
+        self._current = None
+        if self.callback is not None:
+            self.callback(record)
+
 
 class Background(object):
     """Background object to be used in conjuction with GMM.
@@ -458,7 +1504,7 @@ def initFromDataMinMax(gmm, data, covar=None, s=None, k=None, rng=np.random):
         s = (vol_data / gmm.K * gamma(gmm.D*0.5 + 1))**(1/gmm.D) / np.sqrt(np.pi)
         logger.info("initializing spheres with s=%.2f in data domain" % s)
 
-    gmm.covar[k,:,:] = s**2 * np.eye(data.shape[1])
+    gmm._set_covar(k, s**2 * np.eye(data.shape[1]))
 
 def initFromDataAtRandom(gmm, data, covar=None, s=None, k=None, rng=np.random):
     """Initialization callback for component means to follow data on scales > s.
@@ -502,7 +1548,7 @@ def initFromDataAtRandom(gmm, data, covar=None, s=None, k=None, rng=np.random):
         logger.info("initializing spheres with s=%.2f near data points" % s)
 
     gmm.mean[k,:] = data[refs] + rng.multivariate_normal(np.zeros(D), s**2 * np.eye(D), size=k_len)
-    gmm.covar[k,:,:] = s**2 * np.eye(data.shape[1])
+    gmm._set_covar(k, s**2 * np.eye(data.shape[1]))
 
 def initFromKMeans(gmm, data, covar=None, rng=np.random):
     """Initialization callback from a k-means clustering run.
@@ -522,6 +1568,7 @@ def initFromKMeans(gmm, data, covar=None, rng=np.random):
     """
     from scipy.cluster.vq import kmeans2
     center, label = kmeans2(data, gmm.K)
+    covar = np.empty((gmm.K, gmm.D, gmm.D))
     for k in xrange(gmm.K):
         mask = (label == k)
         gmm.amp[k] = mask.sum() / len(data)
@@ -529,10 +1576,11 @@ def initFromKMeans(gmm, data, covar=None, rng=np.random):
         d_m = data[mask] - gmm.mean[k]
         # funny way of saying: for each point i, do the outer product
         # of d_m with its transpose and sum over i
-        gmm.covar[k,:,:] = (d_m[:, :, None] * d_m[:, None, :]).sum(axis=0) / len(data)
+        covar[k] = (d_m[:, :, None] * d_m[:, None, :]).sum(axis=0) / len(data)
+    gmm._set_covar(slice(None), covar)
 
 
-def fit(gmm, data, covar=None, R=None, init_method='random', w=0., cutoff=None, sel_callback=None, oversampling=10, covar_callback=None, background=None, tol=1e-3, maxiter=None, frozen=None, split_n_merge=False, rng=np.random):
+def fit(gmm, data, covar=None, R=None, covar_index=None, weights=None, init_method='random', w=0., cutoff=None, sel_callback=None, oversampling=10, covar_callback=None, background=None, tol=1e-3, maxiter=None, frozen=None, split_n_merge=False, accelerate=False, auto_freeze=None, multires=None, metrics=None, checkpoint=None, checkpoint_interval=10, resume=False, pool=None, processes=None, rng=np.random):
     """Fit GMM to data.
 
     If given, init_callback is called to set up the GMM components. Then, the
@@ -540,9 +1588,15 @@ def fit(gmm, data, covar=None, R=None, init_method='random', w=0., cutoff=None,
 
     Args:
         gmm: an instance if GMM
-        data: numpy array (N,D)
-        covar: sample noise covariance; numpy array (N,D,D) or (D,D) if i.i.d.
-        R: sample projection matrix (full rank); numpy array (N,D,D)
+        data: numpy array (N,D), missing features are set to np.nan
+        covar: sample noise covariance; numpy array (N,D,D) or (D,D) if i.i.d.,
+            or (C,D,D) table of unique covariances if covar_index is set,
+            must be diagonal for gmm.covariance_type 'diag', 'spherical', 'lowrank'
+        R: sample projection matrix (full rank); numpy array (N,D,D),
+            not supported for gmm.covariance_type 'diag', 'spherical', 'lowrank'
+        covar_index: numpy array (N,) of indices into the covar table
+        weights: numpy array (N,) of positive sample weights, e.g. the number
+            of occurrences of each unique sample
         init_method (string): one of ['random', 'minmax', 'kmeans', 'none']
             defines the method to initialize the GMM components
         w (float): minimum covariance regularization
@@ -558,6 +1612,18 @@ def fit(gmm, data, covar=None, R=None, init_method='random', w=0., cutoff=None,
         maxiter (int): maximum number of iterations of EM
         frozen (iterable or dict): index list of components that are not updated
         split_n_merge (int): number of split & merge attempts
+        accelerate (bool): whether to extrapolate EM steps with SQUAREM
+        auto_freeze (int): if set, components that have not changed for that
+            many iterations are skipped until the components in their
+            neighborhood change, requires cutoff
+        multires (iterable): increasing fractions of the data, e.g. [0.01, 0.1],
+            that are fit in turn before all data
+        metrics: an instance of FitMetrics to record timings and diagnostics
+        checkpoint (str): directory to store the state of the fit
+        checkpoint_interval (int): number of EM iterations between checkpoints
+        resume (bool): whether to continue the fit from checkpoint
+        pool: multiprocessing.Pool to use, will be created if None
+        processes (int): number of processes to use, defaults to all
         rng: numpy.random.RandomState for deterministic behavior
 
     Notes:
@@ -567,6 +1633,33 @@ def fit(gmm, data, covar=None, R=None, init_method='random', w=0., cutoff=None,
         In either case, amplitudes will be updated to reflect any changes made.
         If frozen["amp"] is set, it will use this list instead.
 
+        To resume a fit from checkpoint, call fit() with resume=True and the
+        same arguments as the original fit. The state of gmm, background, and
+        rng is then restored, and the fit continues with the same steps as the
+        uninterrupted fit would have taken. If the fit had finished, its result
+        is returned directly. Without a checkpoint, the fit starts afresh.
+
+        If many samples share the same noise covariance, T = covar + C_k is
+        only inverted once per component and unique covariance. Per-sample
+        covariances with only few unique entries are detected automatically,
+        alternatively, they can be given as table with covar_index.
+
+        With weights, sample i counts as weights[i] samples in the M-step and
+        in the mean log-likelihood, so that data compressed to unique samples
+        and their counts can be fit instead of the full data. Weights need not
+        be integer. The initialization ignores them.
+
+        With per-sample noise covariances or projections R, setting
+        pygmmis.use_jit = True before creating the pool evaluates the
+        per-sample loops with kernels compiled by numba, if it is installed.
+        They agree with the default numpy code to rounding errors.
+
+        With multires, the model is first fit to nested random subsets of
+        the data, each stage starting from the result of the previous one, so
+        that the components are placed with cheap iterations and the fit to
+        all data only needs a few. Split'n'merge and checkpoints only apply to
+        the fit to all data.
+
     Returns:
         mean log-likelihood (float), component neighborhoods (list of ints)
 
@@ -575,55 +1668,111 @@ def fit(gmm, data, covar=None, R=None, init_method='random', w=0., cutoff=None,
     """
 
     N = len(data)
+    if weights is not None:
+        weights = np.asarray(weights, dtype='float')
+        if weights.shape != (N,):
+            raise RuntimeError("weights must have one entry per sample")
+        if (weights <= 0).any():
+            raise RuntimeError("weights must be positive")
+    if auto_freeze and cutoff is None:
+        # without neighborhoods, every component overlaps with every other
+        raise RuntimeError("auto_freeze needs cutoff to be set")
+
     # if there are data (features) missing, i.e. masked as np.nan, set them to zeros
-    # and create/set covariance elements to very large value to reduce its weight
-    # to effectively zero
+    # and marginalize over them: samples are grouped by their pattern of
+    # observed features, the likelihoods are computed in the observed subspace
+    data_ = createShared(data.copy())
     missing = np.isnan(data)
+    keys = []
+    observed = covar_table = None
     if missing.any():
-        data_ = createShared(data.copy())
         data_[missing] = 0 # value does not matter as long as it's not nan
-        if covar is None:
-            covar = np.zeros((gmm.D, gmm.D))
-            # need to create covar_callback if imputation is requested
-            if sel_callback is not None:
-                from functools import partial
-                covar_callback = partial(covar_callback_default, default=np.zeros((gmm.D, gmm.D)))
-        if covar.shape == (gmm.D, gmm.D):
-            covar_ = createShared(np.tile(covar, (N,1,1)))
-        else:
-            covar_ = createShared(covar.copy())
-
-        large = 1e10
-        for d in range(gmm.D):
-            covar_[missing[:,d],d,d] += large
-            covar_[missing[:,d],d,d] += large
+        observed, pattern_index = np.unique(~missing, axis=0, return_inverse=True)
+        keys.append(pattern_index.ravel())
+    # if only few noise covariances are unique, group the samples by them
+    # to invert T once per component and group
+    if covar_index is None and covar is not None and covar.shape != (gmm.D, gmm.D):
+        covar_table, covar_index = _unique_covar(covar)
+    elif covar_index is not None:
+        covar_table = covar
+        if len(covar_index) != N:
+            raise RuntimeError("covar_index must have one entry per sample")
+    if covar_table is not None:
+        keys.append(np.asarray(covar_index).ravel())
+        covar_ = None
+    elif covar is None or covar.shape == (gmm.D, gmm.D):
+        covar_ = covar
     else:
-        data_ = createShared(data.copy())
-        if covar is None or covar.shape == (gmm.D, gmm.D):
-            covar_ = covar
-        else:
-            covar_ = createShared(covar.copy())
+        covar_ = createShared(covar.copy())
+    # groups: observed features and noise covariance of each group,
+    # and group index of each sample
+    groups = None
+    if len(keys):
+        keys, group_index = np.unique(np.column_stack(keys), axis=0, return_inverse=True)
+        groups = (None if observed is None else observed[keys[:,0]], None if covar_table is None else covar_table[keys[:,-1]], group_index.ravel())
+
+    # restore state from checkpoint
+    state = None
+    if checkpoint is not None:
+        checkpoint = _Checkpoint(checkpoint, interval=checkpoint_interval)
+        if resume:
+            state = checkpoint.load(gmm, background, rng)
+        if state is not None:
+            info, arrays = state
+            U = _unpack_U(arrays)
+            if info["stage"] == "done":
+                return info["log_L"], U
+            logger.info("resuming fit at stage %s" % info["stage"])
 
     # init components
     if init_method.lower() not in ['random', 'minmax', 'kmeans', 'none']:
         raise NotImplementedError("init_mehod %s not in ['random', 'minmax', 'kmeans', 'none']" % init_method)
-    if init_method.lower() == 'random':
-        initFromDataAtRandom(gmm, data_, covar=covar_, rng=rng)
-    if init_method.lower() == 'minmax':
-        initFromDataMinMax(gmm, data_, covar=covar_, rng=rng)
-    if init_method.lower() == 'kmeans':
-        initFromKMeans(gmm, data_, covar=covar_, rng=rng)
+    if state is None:
+        if init_method.lower() == 'random':
+            initFromDataAtRandom(gmm, data_, covar=covar_, rng=rng)
+        if init_method.lower() == 'minmax':
+            initFromDataMinMax(gmm, data_, covar=covar_, rng=rng)
+        if init_method.lower() == 'kmeans':
+            initFromKMeans(gmm, data_, covar=covar_, rng=rng)
 
     # test if callbacks are consistent
     if sel_callback is not None and covar is not None and covar_callback is None:
         raise NotImplementedError("covar is set, but covar_callback is None: imputation samples inconsistent")
 
+    # test if covariance type supports the fit options
+    if gmm.covariance_type != 'full' and split_n_merge:
+        raise NotImplementedError("split_n_merge requires covariance_type 'full'")
+    if gmm.covariance_type in _diagonal_types:
+        if R is not None:
+            raise NotImplementedError("covariance_type '%s' does not support R" % gmm.covariance_type)
+        if covar is not None and not _is_diagonal(covar):
+            raise NotImplementedError("covariance_type '%s' requires diagonal covar" % gmm.covariance_type)
+
     # set up pool
-    import multiprocessing
-    pool = multiprocessing.Pool()
-    n_chunks, chunksize = gmm._mp_chunksize()
+    own_pool = pool is None
+    if own_pool:
+        import multiprocessing
+        t0 = time.time()
+        pool = multiprocessing.Pool(processes=processes)
+        if metrics is not None:
+            metrics.pool_setup += time.time() - t0
+    n_chunks, chunksize = gmm._mp_chunksize(processes)
+
+    # multi-resolution: fit growing random subsets of the data first
+    if multires is not None and state is None:
+        order = rng.permutation(N)
+        kwargs = dict(covar=covar if covar_table is None else covar_table, R=R, covar_index=covar_index, weights=weights)
+        for fraction in multires:
+            size = int(fraction * N)
+            if size < gmm.K or size >= N:
+                continue
+            logger.info("multi-resolution stage with %d samples" % size)
+            subset = np.sort(order[:size])
+            fit(gmm, data[subset], init_method='none', w=w, cutoff=cutoff, sel_callback=sel_callback, oversampling=oversampling, covar_callback=covar_callback, background=background, tol=tol, maxiter=maxiter, frozen=frozen, accelerate=accelerate, auto_freeze=auto_freeze, metrics=metrics, pool=pool, rng=rng, **_sample_kwargs(kwargs, subset))
 
     # containers
+    # buffers for the EM iterations
+    ws = _Workspace()
     # precautions for cases when some points are treated as outliers
     # and not considered as belonging to any component
     log_S = createShared(np.zeros(N))          # S = sum_k p(x|k)
@@ -635,18 +1784,16 @@ def fit(gmm, data, covar=None, R=None, init_method='random', w=0., cutoff=None,
     U = [None for k in xrange(gmm.K)]          # U = {x close to k}
     p_bg = None
     if background is not None:
-        gmm.amp *= 1 - background.amp          # GMM amp + BG amp = 1
-        p_bg = [None]                          # p_bg = p(x|BG), no log because values are larger
+        if state is None:
+            gmm.amp *= (1 - background.amp) / gmm.amp.sum() # GMM amp + BG amp = 1
+        p_bg = [None, None]                    # p_bg = p(x|BG), no log because values are larger
+                                               # and its cached value without BG amp
         if covar is not None:
             # check if covar is diagonal and issue warning if not
             mess = "background model will only consider diagonal elements of covar"
             nondiag = ~np.eye(gmm.D, dtype='bool')
-            if covar.shape == (gmm.D, gmm.D):
-                if (covar[nondiag] != 0).any():
-                    logger.warning(mess)
-            else:
-                if (covar[np.tile(nondiag,(N,1,1))] != 0).any():
-                    logger.warning(mess)
+            if (covar[..., nondiag] != 0).any():
+                logger.warning(mess)
 
     # check if all component parameters can be changed
     changeable = {"amp": slice(None), "mean": slice(None), "covar": slice(None)}
@@ -663,7 +1810,19 @@ def fit(gmm, data, covar=None, R=None, init_method='random', w=0., cutoff=None,
         else:
             raise NotImplementedError("frozen should be list of indices or dictionary with keys in ['amp','mean','covar']")
 
-    log_L, N, N2 = _EM(gmm, log_p, U, T_inv, log_S, H, data_, covar=covar_, R=R, sel_callback=sel_callback, oversampling=oversampling, covar_callback=covar_callback, w=w, pool=pool, chunksize=chunksize, cutoff=cutoff, background=background, p_bg=p_bg, changeable=changeable, maxiter=maxiter, tol=tol, rng=rng)
+    # stage of the fit: main EM or one of the split'n'merge EM runs,
+    # and the state of the EM run in that stage if resuming
+    stage = "EM"
+    em_state = None
+    if state is not None:
+        stage = info["stage"]
+        em_state = state
+    if checkpoint is not None:
+        checkpoint.context = {"stage": stage}
+
+    if stage == "EM":
+        log_L, N, N2 = _EM(gmm, log_p, U, T_inv, log_S, H, data_, covar=covar_, R=R, groups=groups, weights=weights, sel_callback=sel_callback, oversampling=oversampling, covar_callback=covar_callback, w=w, pool=pool, chunksize=chunksize, cutoff=cutoff, background=background, p_bg=p_bg, changeable=changeable, maxiter=maxiter, tol=tol, accelerate=accelerate, auto_freeze=auto_freeze, ws=ws, metrics=metrics, checkpoint=checkpoint, state=em_state, rng=rng)
+        em_state = None
 
     # should we try to improve by split'n'merge of components?
     # if so, keep backup copy
@@ -677,16 +1836,36 @@ def fit(gmm, data, covar=None, R=None, init_method='random', w=0., cutoff=None,
             if gmm_ is None:
                 gmm_ = GMM(gmm.K, gmm.D)
 
-            gmm_.amp[:] = gmm.amp[:]
-            gmm_.mean[:] = gmm.mean[:,:]
-            gmm_.covar[:,:,:] = gmm.covar[:,:,:]
-            U_ = [U[k].copy() for k in xrange(gmm.K)]
-
-            changing, cleanup = _findSNMComponents(gmm, U, log_p, log_S, N+N2, pool=pool, chunksize=chunksize)
-            logger.info("merging %d and %d, splitting %d" % tuple(changing))
-
-            # modify components
-            _update_snm(gmm, changing, U, N+N2, cleanup)
+            if em_state is None:
+                gmm_.amp[:] = gmm.amp[:]
+                gmm_.mean[:] = gmm.mean[:,:]
+                gmm_.covar[:,:,:] = gmm.covar[:,:,:]
+                U_ = [U[k].copy() for k in xrange(gmm.K)]
+
+                t0 = time.time()
+                changing, cleanup = _findSNMComponents(gmm, U, log_p, log_S, N+N2, pool=pool, chunksize=chunksize)
+                logger.info("merging %d and %d, splitting %d" % tuple(changing))
+
+                # modify components
+                _update_snm(gmm, changing, U, N+N2, cleanup)
+                if metrics is not None:
+                    metrics.split_n_merge.append({"time": time.time() - t0, "changing": changing, "accepted": False})
+                stage = "SNM_P"
+            else:
+                # resume split'n'merge attempt from checkpoint
+                gmm_.amp[:] = arrays["snm_amp"]
+                gmm_.mean[:,:] = arrays["snm_mean"]
+                gmm_.covar[:,:,:] = arrays["snm_covar"]
+                U_ = _unpack_U(arrays, "snm_U")
+                changing = np.array(info["changing"])
+                log_L = info["snm_log_L"]
+                N, N2 = info["snm_N"], info["snm_N2"]
+                split_n_merge = info["split_n_merge"]
+
+            if checkpoint is not None:
+                checkpoint.context = {"stage": stage, "changing": [int(k) for k in changing], "snm_log_L": float(log_L), "snm_N": float(N), "snm_N2": float(N2), "split_n_merge": int(split_n_merge)}
+                checkpoint.context_arrays = {"snm_amp": gmm_.amp, "snm_mean": gmm_.mean, "snm_covar": gmm_.covar}
+                checkpoint.context_arrays.update(_pack_U(U_, "snm_U"))
 
             # run partial EM on changeable components
             # NOTE: for a partial run, we'd only need the change to Log_S from the
@@ -701,11 +1880,17 @@ def fit(gmm, data, covar=None, R=None, init_method='random', w=0., cutoff=None,
             # would be over-estimated.
             # Effectively, partial runs are as expensive as full runs.
 
-            changeable['amp'] = changeable['mean'] = changeable['covar'] = np.in1d(xrange(gmm.K), changing, assume_unique=True)
-            log_L_, N_, N2_ = _EM(gmm, log_p, U, T_inv, log_S, H, data_, covar=covar_, R=R,  sel_callback=sel_callback, oversampling=oversampling, covar_callback=covar_callback, w=w, pool=pool, chunksize=chunksize, cutoff=cutoff, background=background, p_bg=p_bg, maxiter=maxiter, tol=tol, prefix="SNM_P", changeable=changeable, rng=rng)
+            if stage == "SNM_P":
+                changeable['amp'] = changeable['mean'] = changeable['covar'] = np.in1d(xrange(gmm.K), changing, assume_unique=True)
+                log_L_, N_, N2_ = _EM(gmm, log_p, U, T_inv, log_S, H, data_, covar=covar_, R=R, groups=groups, weights=weights, sel_callback=sel_callback, oversampling=oversampling, covar_callback=covar_callback, w=w, pool=pool, chunksize=chunksize, cutoff=cutoff, background=background, p_bg=p_bg, maxiter=maxiter, tol=tol, prefix="SNM_P", changeable=changeable, accelerate=accelerate, auto_freeze=auto_freeze, ws=ws, metrics=metrics, checkpoint=checkpoint, state=em_state, rng=rng)
+                em_state = None
+                stage = "SNM_F"
+                if checkpoint is not None:
+                    checkpoint.context["stage"] = stage
 
             changeable['amp'] = changeable['mean'] = changeable['covar'] = slice(None)
-            log_L_, N_, N2_ = _EM(gmm, log_p, U, T_inv, log_S, H, data_, covar=covar_, R=R,  sel_callback=sel_callback, oversampling=oversampling, covar_callback=covar_callback, w=w, pool=pool, chunksize=chunksize, cutoff=cutoff, background=background, p_bg=p_bg, maxiter=maxiter, tol=tol, prefix="SNM_F", changeable=changeable, rng=rng)
+            log_L_, N_, N2_ = _EM(gmm, log_p, U, T_inv, log_S, H, data_, covar=covar_, R=R, groups=groups, weights=weights, sel_callback=sel_callback, oversampling=oversampling, covar_callback=covar_callback, w=w, pool=pool, chunksize=chunksize, cutoff=cutoff, background=background, p_bg=p_bg, maxiter=maxiter, tol=tol, prefix="SNM_F", changeable=changeable, accelerate=accelerate, auto_freeze=auto_freeze, ws=ws, metrics=metrics, checkpoint=checkpoint, state=em_state, rng=rng)
+            em_state = None
 
             if log_L >= log_L_:
                 # revert to backup
@@ -716,14 +1901,42 @@ def fit(gmm, data, covar=None, R=None, init_method='random', w=0., cutoff=None,
                 logger.info ("split'n'merge likelihood decreased: reverting to previous model")
                 break
 
+            if metrics is not None:
+                metrics.split_n_merge[-1]["accepted"] = True
             log_L = log_L_
             split_n_merge -= 1
 
-    pool.close()
+    if checkpoint is not None:
+        checkpoint.context = {"stage": "done", "log_L": float(log_L)}
+        checkpoint.context_arrays = {}
+        checkpoint.save(gmm, background, rng, arrays=_pack_U(U))
+
+    if own_pool:
+        pool.close()
     return log_L, U
 
+# neighborhoods U as concatenated indices and their sizes (-1 for None)
+def _pack_U(U, name="U"):
+    sizes = np.array([-1 if U_k is None else len(U_k) for U_k in U], dtype='int')
+    indices = [U_k for U_k in U if U_k is not None]
+    if len(indices):
+        indices = np.concatenate(indices)
+    else:
+        indices = np.zeros(0, dtype='int')
+    return {name: indices, name + "_size": sizes}
+
+def _unpack_U(arrays, name="U"):
+    U, offset = [], 0
+    for size in arrays[name + "_size"]:
+        if size < 0:
+            U.append(None)
+        else:
+            U.append(np.array(arrays[name][offset:offset+size]))
+            offset += size
+    return U
+
 # run EM sequence
-def _EM(gmm, log_p, U, T_inv, log_S, H, data, covar=None, R=None, sel_callback=None, oversampling=10, covar_callback=None, background=None, p_bg=None, w=0, pool=None, chunksize=1, cutoff=None, maxiter=None, tol=1e-3, prefix="", changeable=None, rng=np.random):
+def _EM(gmm, log_p, U, T_inv, log_S, H, data, covar=None, R=None, groups=None, weights=None, sel_callback=None, oversampling=10, covar_callback=None, background=None, p_bg=None, w=0, pool=None, chunksize=1, cutoff=None, maxiter=None, tol=1e-3, prefix="", changeable=None, accelerate=False, auto_freeze=None, ws=None, metrics=None, checkpoint=None, state=None, rng=np.random):
 
     # compute effective cutoff for chi2 in D dimensions
     if cutoff is not None:
@@ -749,20 +1962,78 @@ def _EM(gmm, log_p, U, T_inv, log_S, H, data, covar=None, R=None, sel_callback=N
     logger.info(header)
 
     # save backup
-    gmm_ = GMM(gmm.K, gmm.D)
-    gmm_.amp[:] = gmm.amp[:]
-    gmm_.mean[:,:] = gmm.mean[:,:]
-    gmm_.covar[:,:,:] = gmm.covar[:,:,:]
+    gmm_ = _copy_gmm(gmm)
     N0 = len(data) # size of original (unobscured) data set (signal and background)
+    if weights is not None:
+        N0 = int(round(weights.sum()))
     N2 = 0         # size of imputed signal sample
     if background is not None:
         bg_amp_ = background.amp
 
+    # for SQUAREM: parameters of the current sequence of plain EM steps,
+    # and the plain EM result in case an extrapolation needs to be undone
+    if accelerate:
+        history = [_get_params(gmm, background)]
+    extrapolated = None
+
+    # for adaptive freezing: number of iterations without change, and
+    # components that are currently skipped
+    changeable_ = changeable
+    dormant = None
+    if auto_freeze:
+        stable = np.zeros(gmm.K, dtype='int')
+        dormant = np.zeros(gmm.K, dtype='bool')
+
+    # continue from checkpoint: gmm, background, and rng are already restored
+    if state is not None:
+        info, arrays = state
+        it, log_L, N, N2, N0 = info["it"], info["log_L"], info["N"], info["N2"], info["N0"]
+        U[:] = _unpack_U(arrays)
+        if accelerate:
+            history = list(np.array(arrays["history"]))
+            if "fallback" in arrays:
+                extrapolated = (np.array(arrays["fallback"]), np.array(arrays["jumped"]))
+        if auto_freeze:
+            stable[:] = arrays["stable"]
+            dormant[:] = arrays["dormant"]
+            changeable_ = {}
+            for key in ["amp", "mean", "covar"]:
+                mask = np.array(arrays["changeable_" + key])
+                changeable_[key] = slice(None) if mask.all() else mask
+            for k in np.flatnonzero(dormant):
+                log_p[k] = np.array(arrays["log_p_%d" % k])
+                if "T_inv_index_%d" % k in arrays:
+                    T_inv[k] = (np.array(arrays["T_inv_%d" % k]), np.array(arrays["T_inv_index_%d" % k]))
+                elif "T_inv_%d" % k in arrays:
+                    T_inv[k] = np.array(arrays["T_inv_%d" % k])
+
     while maxiter is None or it < maxiter: # limit loop in case of slow convergence
-        log_L_, N, N2, N0 = _EMstep(gmm, log_p, U, T_inv, log_S, H, N0, data, covar=covar, R=R,  sel_callback=sel_callback, oversampling=oversampling, covar_callback=covar_callback, background=background, p_bg=p_bg , w=w, pool=pool, chunksize=chunksize, cutoff=cutoff_nd, tol=tol, changeable=changeable, it=it, rng=rng)
+        if metrics is not None:
+            metrics._start(prefix, it)
+        log_L_, N, N2, N0 = _EMstep(gmm, log_p, U, T_inv, log_S, H, N0, data, covar=covar, R=R, groups=groups, weights=weights, sel_callback=sel_callback, oversampling=oversampling, covar_callback=covar_callback, background=background, p_bg=p_bg , w=w, pool=pool, chunksize=chunksize, cutoff=cutoff_nd, tol=tol, changeable=changeable_, it=it, dormant=dormant, ws=ws, metrics=metrics, rng=rng)
+
+        # safeguard of extrapolation: if likelihood is worse than before,
+        # go back to the plain EM step
+        if extrapolated is not None:
+            fallback, jumped = extrapolated
+            extrapolated = None
+            if log_L_ < log_L - tol:
+                _set_params(gmm, background, fallback)
+                _set_params(gmm_, None, fallback)
+                if background is not None:
+                    bg_amp_ = background.amp
+                if cutoff is not None:
+                    for k in jumped:
+                        U[k] = None
+                history = [fallback]
+                logger.info("%s%d\textrapolation rejected: reverting to EM step" % (prefix, it))
+                if metrics is not None:
+                    metrics._finish(log_L=log_L_, moved=0, rejected=True, U=U, N=len(data), dormant=dormant)
+                it += 1
+                continue
 
         # check if component has moved by more than sigma/2
-        shift2 = np.einsum('...i,...ij,...j', gmm.mean - gmm_.mean, np.linalg.inv(gmm_.covar), gmm.mean - gmm_.mean)
+        shift2 = _shift2(gmm_, gmm.mean)
         moved = np.flatnonzero(shift2 > shift_cutoff)
         status_mess = "%s%d\t%d" % (prefix, it, N)
         if sel_callback is not None:
@@ -771,15 +2042,15 @@ def _EM(gmm, log_p, U, T_inv, log_S, H, data, covar=None, R=None, sel_callback=N
             status_mess += "\t%.3f" % bg_amp_
         status_mess += "\t%.3f\t%d" % (log_L_, gmm.K - moved.size)
         logger.info(status_mess)
+        if metrics is not None:
+            metrics._finish(log_L=log_L_, moved=moved.size, U=U, N=len(data), dormant=dormant)
 
         # convergence tests:
         if it > 0 and log_L_ < log_L + tol:
             # with imputation or background fitting, observed logL can decrease
             # allow some slack, but revert to previous model if it gets worse
             if log_L_ < log_L - tol:
-                gmm.amp[:] = gmm_.amp[:]
-                gmm.mean[:,:] = gmm_.mean[:,:]
-                gmm.covar[:,:,:] = gmm_.covar[:,:,:]
+                _copy_params(gmm, gmm_)
                 if background is not None:
                     background.amp = bg_amp_
                 logger.info("likelihood decreased: reverting to previous model")
@@ -789,6 +2060,11 @@ def _EM(gmm, log_p, U, T_inv, log_S, H, data, covar=None, R=None, sel_callback=N
                 logger.info("likelihood converged within tolerance %r: stopping here." % tol)
                 break
 
+        # skip components that have stabilized,
+        # based on the neighborhoods of the last E-step
+        if auto_freeze:
+            changeable_ = _auto_freeze(gmm, gmm_, U, shift2, shift_cutoff, stable, dormant, changeable, auto_freeze, len(data))
+
         # force update to U for all moved components
         if cutoff is not None:
             for k in moved:
@@ -797,28 +2073,210 @@ def _EM(gmm, log_p, U, T_inv, log_S, H, data, covar=None, R=None, sel_callback=N
         if moved.size:
             logger.debug("resetting neighborhoods of moving components: (" + ("%d," * moved.size + ")") % tuple(moved))
 
+        # SQUAREM: after two plain EM steps, extrapolate along them
+        if accelerate:
+            history.append(_get_params(gmm, background))
+            if len(history) == 3:
+                theta = _squarem(gmm, background, history, changeable_)
+                if theta is not None:
+                    # components that jumped need new neighborhoods
+                    mean = gmm.mean.copy()
+                    _set_params(gmm, background, theta)
+                    shift2 = _shift2(gmm, mean)
+                    jumped = np.flatnonzero(shift2 > shift_cutoff)
+                    if cutoff is not None:
+                        for k in jumped:
+                            U[k] = None
+                    extrapolated = (history[2], jumped)
+                    history = [theta]
+                else:
+                    history = history[2:]
+
         # update all important _ quantities for convergence test(s)
         log_L = log_L_
         # backup to see if components move or if next step gets worse
         # note: not gmm = gmm_ !
-        gmm_.amp[:] = gmm.amp[:]
-        gmm_.mean[:,:] = gmm.mean[:,:]
-        gmm_.covar[:,:,:] = gmm.covar[:,:,:]
+        _copy_params(gmm_, gmm)
         if background is not None:
             bg_amp_ = background.amp
 
         it += 1
 
+        if checkpoint is not None and it % checkpoint.interval == 0:
+            info = {"it": it, "log_L": float(log_L), "N": float(N), "N2": float(N2), "N0": int(N0)}
+            arrays = _pack_U(U)
+            if accelerate:
+                arrays["history"] = np.array(history)
+                if extrapolated is not None:
+                    arrays["fallback"], arrays["jumped"] = extrapolated
+            if auto_freeze:
+                arrays["stable"] = stable
+                arrays["dormant"] = dormant
+                for key in ["amp", "mean", "covar"]:
+                    mask = np.zeros(gmm.K, dtype='bool')
+                    mask[changeable_[key]] = True
+                    arrays["changeable_" + key] = mask
+                # dormant components reuse the results of previous E-steps
+                for k in np.flatnonzero(dormant):
+                    arrays["log_p_%d" % k] = log_p[k]
+                    if isinstance(T_inv[k], tuple): # grouped by observed features or noise
+                        arrays["T_inv_%d" % k], arrays["T_inv_index_%d" % k] = T_inv[k]
+                    elif T_inv[k] is not None:
+                        arrays["T_inv_%d" % k] = T_inv[k]
+            checkpoint.save(gmm, background, rng, info=info, arrays=arrays)
+
     return log_L, N, N2
 
+# chi2 of the shifts of the means of gmm to mean wrt the covariances of gmm,
+# from the stored covariance parameters without inverting (K,D,D) arrays
+def _shift2(gmm, mean):
+    dx = gmm.mean - mean
+    if gmm.covariance_type == 'lowrank':
+        return _woodbury(gmm.factor, 1 / gmm.psi, dx)[0]
+    if gmm.covariance_type in _diagonal_types:
+        return np.einsum('...i,...i', dx**2, 1 / gmm._diag_var)
+    if gmm.covariance_type == 'tied':
+        return np.einsum('...i,ij,...j', dx, np.linalg.inv(gmm.tied_covar), dx)
+    return np.einsum('...i,...ij,...j', dx, np.linalg.inv(gmm.covar), dx)
+
+# absolute change of the covariance parameters of each component from gmm_ to
+# gmm, and their absolute size in gmm_
+def _covar_change(gmm, gmm_):
+    change, size = 0, 0
+    for name in gmm._covar_params:
+        param, param_ = getattr(gmm, name), getattr(gmm_, name)
+        if name == 'tied_covar': # shared by all components
+            param, param_ = param[None], param_[None]
+        axes = tuple(xrange(1, param.ndim))
+        change = change + np.abs(param - param_).sum(axis=axes)
+        size = size + np.abs(param_).sum(axis=axes)
+    return change, size
+
+def _auto_freeze(gmm, gmm_, U, shift2, shift_cutoff, stable, dormant, changeable, patience, N):
+    # update the count of iterations without change: the mean shift is well
+    # below the cutoff for moving, amplitude and covariance change by < 1%
+    still = (shift2 < shift_cutoff / 100) & (np.abs(gmm.amp - gmm_.amp) < 1e-2 * gmm_.amp)
+    change, size = _covar_change(gmm, gmm_)
+    still &= change < 1e-2 * size
+    stable[:] = np.where(still, stable + 1, 0)
+
+    # thaw dormant components if changing ones overlap their neighborhood,
+    # with a fresh neighborhood since the changing ones may have moved in
+    changing = np.flatnonzero(~still & ~dormant)
+    if dormant.any() and changing.size:
+        near = np.zeros(N, dtype='bool')
+        for j in changing:
+            near[U[j]] = True
+        thaw = [k for k in np.flatnonzero(dormant) if near[U[k]].any()]
+        if len(thaw):
+            logger.debug("thawing components: (" + ("%d," * len(thaw) + ")") % tuple(thaw))
+        for k in thaw:
+            dormant[k] = False
+            stable[k] = 0
+            U[k] = None
+
+    # freeze stable components, but keep at least one changeable
+    freeze = ~dormant & (stable >= patience)
+    masks = {}
+    for key in changeable.keys():
+        masks[key] = np.zeros(gmm.K, dtype='bool')
+        masks[key][changeable[key]] = True
+    if freeze.any() and (masks['amp'] & ~dormant & ~freeze).any():
+        logger.debug("freezing components: (" + ("%d," * freeze.sum() + ")") % tuple(np.flatnonzero(freeze)))
+        dormant |= freeze
+
+    if not dormant.any():
+        return changeable
+    for key in masks.keys():
+        masks[key] &= ~dormant
+    return masks
+
+def _get_params(gmm, background=None):
+    # all model parameters as one vector
+    theta = np.concatenate([gmm.amp, gmm.mean.flatten()] + [getattr(gmm, name).flatten() for name in gmm._covar_params])
+    if background is not None:
+        theta = np.append(theta, background.amp)
+    return theta
+
+def _split_params(gmm, theta):
+    # views of the GMM parameters in theta, by name
+    params = {}
+    start = 0
+    for name in ('amp', 'mean') + gmm._covar_params:
+        shape = getattr(gmm, name).shape
+        size = int(np.prod(shape))
+        params[name] = theta[start:start+size].reshape(shape)
+        start += size
+    return params
+
+def _set_params(gmm, background, theta):
+    # inverse of _get_params
+    for name, value in _split_params(gmm, theta).items():
+        getattr(gmm, name)[...] = value
+    if background is not None:
+        background.amp = theta[-1]
+
+def _squarem(gmm, background, history, changeable, max_steps=10):
+    # SQUAREM extrapolation (scheme S3 of Varadhan & Roland 2008) from
+    # three parameter sets that are connected by two EM steps.
+    # Returns None if extrapolation is not beneficial.
+    theta0, theta1, theta2 = history
+    r = theta1 - theta0
+    v = theta2 - theta1 - r
+    v2 = np.dot(v, v)
+    if v2 == 0:
+        return None
+    alpha = -np.sqrt(np.dot(r, r) / v2)
+    if alpha > -1:
+        return None
+
+    # step back towards theta2 (at alpha=-1) until parameters are valid
+    K = gmm.K
+    total = theta2[:K].sum()
+    if background is not None:
+        total += theta2[-1]
+    for step in xrange(max_steps):
+        theta = theta0 - 2*alpha*r + alpha**2 * v
+        params = _split_params(gmm, theta)
+        amp = params['amp']
+        # renormalize amplitudes such that GMM amp + BG amp stays the same
+        total_ = total - amp.sum() + amp[changeable['amp']].sum()
+        if background is not None:
+            total_ -= theta[-1]
+        if gmm.covariance_type == 'lowrank':
+            valid_covar = (params['psi'] > 0).all()
+        elif gmm.covariance_type in ['diag', 'spherical']:
+            valid_covar = (params['var'] > 0).all()
+        else:
+            valid_covar = (np.linalg.eigvalsh(params[gmm._covar_params[0]]) > 0).all()
+        valid = (amp > 0).all() and total_ > 0 and valid_covar
+        if background is not None:
+            valid &= background.amp_min <= theta[-1] <= background.amp_max
+        if valid:
+            amp[changeable['amp']] *= total_ / amp[changeable['amp']].sum()
+            return theta
+        alpha = (alpha - 1) / 2
+    return None
+
 # run one EM step
-def _EMstep(gmm, log_p, U, T_inv, log_S, H, N0, data, covar=None, R=None, sel_callback=None, oversampling=10, covar_callback=None, background=None, p_bg=None, w=0, pool=None, chunksize=1, cutoff=None, tol=1e-3, changeable=None, it=0, rng=np.random):
+def _EMstep(gmm, log_p, U, T_inv, log_S, H, N0, data, covar=None, R=None, groups=None, weights=None, sel_callback=None, oversampling=10, covar_callback=None, background=None, p_bg=None, w=0, pool=None, chunksize=1, cutoff=None, tol=1e-3, changeable=None, it=0, dormant=None, ws=None, metrics=None, rng=np.random):
+
+    if ws is None:
+        ws = _Workspace()
 
     # NOTE: T_inv (in fact (T_ik)^-1 for all samples i and components k)
     # is very large and is unfortunately duplicated in the parallelized _Mstep.
     # If memory is too limited, one can recompute T_inv in _Msums() instead.
-    log_L = _Estep(gmm, log_p, U, T_inv, log_S, H, data, covar=covar, R=R, background=background, p_bg=p_bg, pool=pool, chunksize=chunksize, cutoff=cutoff, it=it)
-    A,M,C,N,B = _Mstep(gmm, U, log_p, T_inv, log_S, H, data, covar=covar, R=R, p_bg=p_bg, pool=pool, chunksize=chunksize)
+    # dormant components are skipped, i.e. their E-step results are reused,
+    # their M-step sums are not computed, and they must not be changeable
+    if metrics is not None:
+        t = time.time()
+    log_L = _Estep(gmm, log_p, U, T_inv, log_S, H, data, covar=covar, R=R, groups=groups, weights=weights, background=background, p_bg=p_bg, pool=pool, chunksize=chunksize, cutoff=cutoff, it=it, skip=dormant)
+    if metrics is not None:
+        t = metrics._lap("E", t)
+    A,M,C,N,B = _Mstep(gmm, U, log_p, T_inv, log_S, H, data, covar=covar, R=R, weights=weights, p_bg=p_bg, pool=pool, chunksize=chunksize, skip=dormant, ws=ws)
+    if metrics is not None:
+        t = metrics._lap("M", t)
 
     A2 = M2 = C2 = B2 = H2 = N2 = 0
 
@@ -834,24 +2292,32 @@ def _EMstep(gmm, log_p, U, T_inv, log_S, H, N0, data, covar=None, R=None, sel_ca
             raise NotImplementedError("R is not None: imputation samples likely inconsistent")
 
         # create fake data with same mechanism as the original data,
-        # but invert selection to get the missing part
-        data2, covar2, N0 = draw(gmm, len(data)*oversampling, sel_callback=sel_callback, orig_size=N0*oversampling, invert_sel=True, covar_callback=covar_callback, background=background, rng=rng)
+        # but invert selection to get the missing part.
+        # With weights, the observed sample size is their sum N
+        sel_callback_ = sel_callback
+        if metrics is not None:
+            sel_callback_ = metrics._timed(sel_callback, "selection")
+        data2, covar2, N0 = draw(gmm, int(round(N*oversampling)), sel_callback=sel_callback_, orig_size=N0*oversampling, invert_sel=True, covar_callback=covar_callback, background=background, rng=rng)
+        if metrics is not None:
+            t = metrics._lap("draw", t)
         U2 = [None for k in xrange(gmm.K)]
         N0 = int(N0/oversampling)
 
         if len(data2) > 0:
-            log_S2 = np.zeros(len(data2))
-            H2 = np.zeros(len(data2), dtype='bool')
+            log_S2 = ws.get("log_S2", len(data2))
+            H2 = ws.get("H2", len(data2), dtype='bool')
             log_p2 = [[] for k in xrange(gmm.K)]
             T2_inv = [None for k in xrange(gmm.K)]
             R2 = None
             if background is not None:
-                p_bg2 = [None]
+                p_bg2 = [None, None]
             else:
                 p_bg2 = None
 
             log_L2 = _Estep(gmm, log_p2, U2, T2_inv, log_S2, H2, data2, covar=covar2, R=R2,  background=background, p_bg=p_bg2, pool=pool, chunksize=chunksize, cutoff=cutoff, it=it)
-            A2,M2,C2,N2,B2 = _Mstep(gmm, U2, log_p2, T2_inv, log_S2, H2, data2, covar=covar2, R=R2, p_bg=p_bg2, pool=pool, chunksize=chunksize)
+            A2,M2,C2,N2,B2 = _Mstep(gmm, U2, log_p2, T2_inv, log_S2, H2, data2, covar=covar2, R=R2, p_bg=p_bg2, pool=pool, chunksize=chunksize, skip=dormant, ws=ws, tag="2")
+            if metrics is not None:
+                t = metrics._lap("imputation", t)
 
             # normalize foer oversampling
             A2 /= oversampling
@@ -863,190 +2329,545 @@ def _EMstep(gmm, log_p, U, T_inv, log_S, H, N0, data, covar=None, R=None, sel_ca
             # check if components have outside selection
             sel_outside = A2 > tol * A
             if sel_outside.any():
-                logger.debug("component inside fractions: " + ("(" + "%.2f," * gmm.K + ")") % tuple(A/(A+A2)))
+                with np.errstate(invalid='ignore'):
+                    logger.debug("component inside fractions: " + ("(" + "%.2f," * gmm.K + ")") % tuple(A/(A+A2)))
 
     _update(gmm, A, M, C, N, B, H, A2, M2, C2, N2, B2, H2, w, changeable=changeable, background=background)
+    if metrics is not None:
+        metrics._lap("update", t)
 
     return log_L, N, N2, N0
 
 # perform E step calculations.
 # If cutoff is set, this will also set the neighborhoods U
-def _Estep(gmm, log_p, U, T_inv, log_S, H, data, covar=None, R=None, background=None, p_bg=None, pool=None, chunksize=1, cutoff=None, it=0, rng=np.random):
+def _Estep(gmm, log_p, U, T_inv, log_S, H, data, covar=None, R=None, groups=None, weights=None, background=None, p_bg=None, pool=None, chunksize=1, cutoff=None, it=0, skip=None, rng=np.random):
     # compute p(i | k) for each k independently in the pool
     # need S = sum_k p(i | k) for further calculation
     # also N = {i | i in neighborhood[k]} for any k
+    # components in skip are not recomputed, their log_p, U, T_inv
+    # from the previous call are reused
     import parmap
     log_S[:] = 0
     H[:] = 0
-    k = 0
-    for log_p[k], U[k], T_inv[k] in \
-    parmap.starmap(_Esum, zip(xrange(gmm.K), U), gmm, data, covar, R, cutoff, pool=pool, chunksize=chunksize):
+    if skip is None:
+        ks = np.arange(gmm.K)
+    else:
+        ks = np.flatnonzero(~skip)
+        for k in np.flatnonzero(skip):
+            log_S[U[k]] += np.exp(log_p[k])
+            H[U[k]] = 1
+    for k, (log_p[k], U[k], T_inv[k]) in \
+    zip(ks, parmap.starmap(_Esum, zip(ks, [U[k] for k in ks]), gmm, data, covar, R, cutoff, groups, pool=pool, chunksize=chunksize)):
         log_S[U[k]] += np.exp(log_p[k]) # actually S, not logS
         H[U[k]] = 1
-        k += 1
 
     if background is not None:
-        p_bg[0] = background.amp * background.p
-        if covar is not None:
-            # This is the zeroth moment of a truncated Normal error distribution
-            # Its calculation is simple only of the covariance is diagonal!
-            # See e.g. Manjunath & Wilhem (2012) if not
-            error = np.ones(len(data))
-            x0,x1 = background.footprint
-            for d in range(gmm.D):
-                if covar.shape == (gmm.D, gmm.D): # one-for-all
-                    denom = np.sqrt(2 * covar[d,d])
-                else:
-                    denom = np.sqrt(2 * covar[:,d,d])
-                # CAUTION: The erf is approximate and returns 0
-                # Thus, we don't add the logs but multiple the value itself
-                # underrun is not a big problem here
-                error *= np.real(scipy.special.erf((data[:,d] - x0[d])/denom)  - scipy.special.erf((data[:,d] - x1[d])/denom)) / 2
-            p_bg[0] *= error
+        # p(x|BG) without amp only depends on data, covar, and footprint:
+        # compute once and cache in p_bg[1]
+        if p_bg[1] is None:
+            p_bg[1] = background.p
+            observed = variance = None
+            if groups is not None and groups[0] is not None:
+                # marginal of the uniform distribution over the observed features
+                observed = groups[0][groups[2]]
+                x0,x1 = background.footprint
+                p_bg[1] = p_bg[1] * np.prod(np.where(observed, 1, x1 - x0), axis=1)
+            if groups is not None and groups[1] is not None:
+                variance = np.diagonal(groups[1], axis1=1, axis2=2)[groups[2]]
+            elif covar is not None:
+                variance = np.diagonal(covar, axis1=-2, axis2=-1)
+            if variance is not None:
+                # This is the zeroth moment of a truncated Normal error distribution
+                # Its calculation is simple only of the covariance is diagonal!
+                # See e.g. Manjunath & Wilhem (2012) if not
+                error = np.ones(len(data))
+                x0,x1 = background.footprint
+                for d in range(gmm.D):
+                    denom = np.sqrt(2 * variance[...,d])
+                    # CAUTION: The erf is approximate and returns 0
+                    # Thus, we don't add the logs but multiple the value itself
+                    # underrun is not a big problem here
+                    error_d = np.real(scipy.special.erf((data[:,d] - x0[d])/denom)  - scipy.special.erf((data[:,d] - x1[d])/denom)) / 2
+                    if observed is not None:
+                        error_d[~observed[:,d]] = 1
+                    error *= error_d
+                p_bg[1] = p_bg[1] * error
+        p_bg[0] = background.amp * p_bg[1]
         log_S[:] = np.log(log_S + p_bg[0])
-        log_L = log_S.mean()
+        log_L = np.average(log_S, weights=weights)
     else:
         # need log(S), but since log(0) isn't a good idea, need to restrict to H
         log_S[H] = np.log(log_S[H])
-        log_L = log_S[H].mean()
+        log_L = np.average(log_S[H], weights=None if weights is None else weights[H])
 
     return log_L
 
+# optional JIT-compiled kernels for the per-sample loops in _Esum and _Msums.
+# Opt in with pygmmis.use_jit = True: they are then compiled with numba on
+# first use if it is installed, otherwise the numpy code paths are used.
+# NOTE: the pool processes see the value of use_jit at the time they are created.
+use_jit = False
+_jit_kernels = None
+
+def _inv_chi2_loop(T, dx, T_inv, chi2, logdet):
+    # for each sample i: T_inv_i = T_i^-1, chi2_i = dx_i^T T_i^-1 dx_i,
+    # logdet_i = log det T_i, using the Cholesky decomposition T_i = L L^T
+    n, D = dx.shape
+    L = np.zeros((D, D))
+    L_inv = np.zeros((D, D))
+    for i in range(n):
+        for a in range(D):
+            for b in range(a+1):
+                s = T[i,a,b]
+                for c in range(b):
+                    s -= L[a,c] * L[b,c]
+                if a == b:
+                    L[a,a] = np.sqrt(s)
+                else:
+                    L[a,b] = s / L[b,b]
+        # L^-1 by forward substitution
+        for a in range(D):
+            L_inv[a,a] = 1 / L[a,a]
+            for b in range(a):
+                s = 0.
+                for c in range(b, a):
+                    s -= L[a,c] * L_inv[c,b]
+                L_inv[a,b] = s / L[a,a]
+        ld = 0.
+        c2 = 0.
+        for a in range(D):
+            ld += np.log(L[a,a])
+            y = 0.
+            for b in range(a+1):
+                y += L_inv[a,b] * dx[i,b]
+            c2 += y * y
+        logdet[i] = 2 * ld
+        chi2[i] = c2
+        # T^-1 = L^-T L^-1
+        for a in range(D):
+            for b in range(a+1):
+                s = 0.
+                for c in range(a, D):
+                    s += L_inv[c,a] * L_inv[c,b]
+                T_inv[i,a,b] = s
+                T_inv[i,b,a] = s
+
+def _moments_loop(C_k, T_inv, d_m, q, R, M, C):
+    # M = sum_i q_i b_i, C = sum_i q_i (b_i b_i^T + B_i) with
+    # b_i = F_i d_m_i, B_i = C_k - F_i G_i, F_i = C_k R_i^T T_i^-1, G_i = R_i C_k
+    # R is ignored if it has no samples, i.e. R_i = 1
+    n, Dr = d_m.shape
+    D = C_k.shape[0]
+    use_R = R.shape[0] > 0
+    A = np.empty((D, Dr))
+    F = np.empty((D, Dr))
+    G = np.empty((Dr, D))
+    b = np.empty(D)
+    for a in range(D):
+        M[a] = 0
+        for c in range(D):
+            C[a,c] = 0
+    for i in range(n):
+        if use_R:
+            for a in range(D):
+                for e in range(Dr):
+                    s = 0.
+                    for c in range(D):
+                        s += C_k[a,c] * R[i,e,c]
+                    A[a,e] = s
+                    G[e,a] = s # C_k is symmetric
+        else:
+            for a in range(D):
+                for e in range(Dr):
+                    A[a,e] = C_k[a,e]
+                    G[e,a] = C_k[e,a]
+        for a in range(D):
+            for e in range(Dr):
+                s = 0.
+                for c in range(Dr):
+                    s += A[a,c] * T_inv[i,c,e]
+                F[a,e] = s
+            s = 0.
+            for e in range(Dr):
+                s += F[a,e] * d_m[i,e]
+            b[a] = s
+            M[a] += q[i] * s
+        for a in range(D):
+            for c in range(a+1):
+                s = b[a] * b[c] + C_k[a,c]
+                for e in range(Dr):
+                    s -= F[a,e] * G[e,c]
+                C[a,c] += q[i] * s
+    for a in range(D):
+        for c in range(a):
+            C[c,a] = C[a,c]
+
+def _get_jit():
+    # compiled kernels, or None if not available or disabled
+    global _jit_kernels
+    if not use_jit:
+        return None
+    if _jit_kernels is None:
+        try:
+            import numba
+            _jit_kernels = {
+                "inv_chi2": numba.njit(cache=True)(_inv_chi2_loop),
+                "moments": numba.njit(cache=True)(_moments_loop)
+            }
+        except ImportError:
+            _jit_kernels = False
+    return _jit_kernels or None
+
+def _take(a, U_k, name, ws):
+    # a[U_k] in a buffer from workspace ws; all of a if U_k is None
+    if U_k is None:
+        return a
+    return np.take(a, U_k, axis=0, out=ws.get(name, (len(U_k),) + a.shape[1:], dtype=a.dtype))
+
 # compute chi^2, and apply selections on component neighborhood based in chi^2
-def _Esum(k, U_k, gmm, data, covar=None, R=None, cutoff=None):
-    # since U_k could be None, need explicit reshape
-    d_ = data[U_k].reshape(-1, gmm.D)
+# NOTE: temporary arrays are from the workspace of the process, the returned
+# arrays must not be.
+def _Esum(k, U_k, gmm, data, covar=None, R=None, cutoff=None, groups=None):
+    ws = _worker_workspace
+    d_ = _take(data, U_k, 'd', ws)
+    n = len(d_)
     if covar is not None:
         if covar.shape == (gmm.D, gmm.D): # one-for-all
             covar_ = covar
         else: # each datum has covariance
-            covar_ = covar[U_k].reshape(-1, gmm.D, gmm.D)
+            covar_ = _take(covar, U_k, 'covar', ws)
     else:
         covar_ = 0
     if R is not None:
-        R_ = R[U_k].reshape(-1, gmm.D, gmm.D)
+        R_ = _take(R, U_k, 'R', ws)
 
     # p(x | k) for all x in the vicinity of k
     # determine all points within cutoff sigma from mean[k]
     if R is None:
-        dx = d_ - gmm.mean[k]
+        dx = np.subtract(d_, gmm.mean[k], out=ws.get('dx', (n, gmm.D)))
     else:
-        dx = d_ - np.dot(R_, gmm.mean[k])
-
-    if covar is None and R is None:
+        dx = np.subtract(d_, np.dot(R_, gmm.mean[k]), out=ws.get('dx', (n, gmm.D)))
+
+    chi2 = ws.get('chi2', n)
+    logdet_T = None
+    D_obs = gmm.D
+    if gmm.covariance_type in _diagonal_types:
+        # T_ik = diag(var_k + noise variances of sample i) for diag and
+        # spherical, T_ik = F_k F_k^T + diag(psi_k + noise variances of sample i)
+        # for lowrank, missing features have infinite variance.
+        # T_inv_k holds the diagonal precisions, with lowrank for the Woodbury
+        # identities, or None if there is no noise
+        var = 0
+        if covar is not None:
+            var = np.diagonal(covar_, axis1=-2, axis2=-1)
+        if groups is not None:
+            g = _take(groups[2], U_k, 'group', ws)
+            if groups[1] is not None:
+                var = var + np.diagonal(groups[1], axis1=1, axis2=2)[g]
+            if groups[0] is not None:
+                var = np.where(groups[0][g], var, np.inf)
+                D_obs = groups[0].sum(axis=1)[g]
+        if gmm.covariance_type == 'lowrank':
+            T_inv_k = 1 / (gmm.psi[k] + var)
+            chi2[:], logdet_T, _ = _woodbury(gmm.factor[k], T_inv_k, dx)
+        else:
+            T_inv_k = 1 / (gmm._diag_var[k] + var)
+            np.einsum('...i,...i', dx**2, T_inv_k, out=chi2)
+            logdet_T = -np.log(T_inv_k, out=np.zeros(np.shape(T_inv_k)), where=T_inv_k > 0).sum(axis=-1)
+        if covar is None and groups is None:
+            T_inv_k = None
+    elif groups is not None:
+        # samples grouped by observed features and/or unique noise covariance:
+        # marginalize over missing features, only observed subspace counts
+        g = _take(groups[2], U_k, 'group', ws)
+        if groups[0] is not None:
+            D_obs = groups[0].sum(axis=1)[g]
+        if R is None:
+            T_k = gmm.covar[k] + covar_
+        else:
+            T_k = np.einsum('...ij,jk,...lk', R_, gmm.covar[k], R_, out=ws.get('T', (n, gmm.D, gmm.D)))
+            T_k += covar_
+        T_inv_k, logdet_T = _inv_grouped(T_k, dx, g, groups, chi2)
+    elif covar is None and R is None:
          T_inv_k = None
-         chi2 = np.einsum('...i,...ij,...j', dx, np.linalg.inv(gmm.covar[k]), dx)
+         np.einsum('...i,...ij,...j', dx, np.linalg.inv(gmm.covar[k]), dx, out=chi2)
     else:
         # with data errors: need to create and return T_ik = covar_i + C_k
         # and weight each datum appropriately
         if R is None:
-            T_inv_k = np.linalg.inv(gmm.covar[k] + covar_)
+            T_k = np.add(gmm.covar[k], covar_, out=ws.get('T', np.shape(covar_)))
         else: # need to project out missing elements: T_ik = R_i C_k R_i^R + covar_i
-            T_inv_k = np.linalg.inv(np.einsum('...ij,jk,...lk', R_, gmm.covar[k], R_) + covar_)
-        chi2 = np.einsum('...i,...ij,...j', dx, T_inv_k, dx)
+            T_k = np.einsum('...ij,jk,...lk', R_, gmm.covar[k], R_, out=ws.get('T', (n, gmm.D, gmm.D)))
+            T_k += covar_
+        jit = _get_jit()
+        if T_k.ndim == 3 and jit is not None:
+            T_inv_k = np.empty(T_k.shape)
+            logdet_T = ws.get('logdet', n)
+            jit["inv_chi2"](T_k, dx, T_inv_k, chi2, logdet_T)
+        else:
+            T_inv_k = np.linalg.inv(T_k)
+            np.einsum('...i,...ij,...j', dx, T_inv_k, dx, out=chi2)
 
     # NOTE: close to convergence, we could stop applying the cutoff because
     # changes to U will be minimal
     if cutoff is not None:
         indices = chi2 < cutoff
         chi2 = chi2[indices]
-        if (covar is not None and covar.shape != (gmm.D, gmm.D)) or R is not None:
+        if isinstance(T_inv_k, tuple):
+            T_inv_k = (T_inv_k[0], T_inv_k[1][indices])
+        elif gmm.covariance_type in _diagonal_types:
+            if T_inv_k is not None and T_inv_k.ndim == 2:
+                T_inv_k = T_inv_k[indices]
+        elif (covar is not None and covar.shape != (gmm.D, gmm.D)) or R is not None:
             T_inv_k = T_inv_k[indices]
+        if np.ndim(logdet_T):
+            logdet_T = logdet_T[indices]
+        if np.ndim(D_obs):
+            D_obs = D_obs[indices]
         if U_k is None:
             U_k = np.flatnonzero(indices)
         else:
             U_k = U_k[indices]
 
     # prevent tiny negative determinants to mess up
-    if covar is None:
+    if logdet_T is not None:
+        sign, logdet = 1, logdet_T
+    elif covar is None:
         (sign, logdet) = np.linalg.slogdet(gmm.covar[k])
     else:
         (sign, logdet) = np.linalg.slogdet(T_inv_k)
         sign *= -1 # since det(T^-1) = 1/det(T)
 
-    log2piD2 = np.log(2*np.pi)*(0.5*gmm.D)
+    log2piD2 = np.log(2*np.pi)*(0.5*D_obs)
     return np.log(gmm.amp[k]) - log2piD2 - sign*logdet/2 - chi2/2, U_k, T_inv_k
 
+# unique noise covariances as table (C,D,D) and the index of each sample in
+# it, or None, None if grouping samples by covariance doesn't pay off:
+# each group has a fixed overhead, each sample without groups needs an O(D^3)
+# inversion, benchmarks put the break-even at C = N D^3 / 5000.
+def _unique_covar(covar):
+    table, index = np.unique(covar.reshape(len(covar), -1), axis=0, return_inverse=True)
+    if len(table) * 5000 > len(covar) * covar.shape[-1]**3:
+        return None, None
+    return table.reshape((-1,) + covar.shape[1:]), index.ravel()
+
+# unique values of index, and for each of them the positions where index has
+# that value, found by sorting in O(n log n) instead of with a mask per value
+def _groupby(index):
+    order = np.argsort(index, kind='mergesort')
+    values, starts = np.unique(index[order], return_index=True)
+    return values, np.split(order, starts[1:])
+
+# inverse of T (plus the noise covariance of the group) in the subspace of the
+# observed features of each group, padded with zeros for the missing features.
+# Also sets chi2 and returns log det of T in that subspace.
+# If T is the same for all samples, it is inverted once per group, and the
+# inverses are returned as (numpy array (G,D,D), group index of each sample),
+# otherwise as numpy array (n,D,D).
+def _inv_grouped(T, dx, g, groups, chi2):
+    D = dx.shape[1]
+    observed, covar_g = groups[:2]
+    present, members = _groupby(g)
+    local = np.empty(len(g), dtype='int')
+    logdet = np.empty(len(dx))
+    if T.ndim == 2:
+        T_inv = np.zeros((len(present), D, D))
+    else:
+        T_inv = np.zeros(T.shape)
+    for j, (group, sel) in enumerate(zip(present, members)):
+        if observed is None:
+            obs = np.arange(D)
+        else:
+            obs = np.flatnonzero(observed[group])
+        local[sel] = j
+        if T.ndim == 2:
+            T_oo = T[np.ix_(obs, obs)]
+            if covar_g is not None:
+                T_oo = T_oo + covar_g[group][np.ix_(obs, obs)]
+            T_inv[j][np.ix_(obs, obs)] = np.linalg.inv(T_oo)
+            logdet[sel] = np.linalg.slogdet(T_oo)[1]
+            dx_ = dx[sel]
+            chi2[sel] = np.einsum('...i,...i', np.dot(dx_, T_inv[j]), dx_)
+        else:
+            T_oo = T[sel][:, obs][:, :, obs]
+            if covar_g is not None:
+                T_oo += covar_g[group][np.ix_(obs, obs)]
+            T_inv[np.ix_(sel, obs, obs)] = np.linalg.inv(T_oo)
+            logdet[sel] = np.linalg.slogdet(T_oo)[1]
+            chi2[sel] = np.einsum('...i,...ij,...j', dx[sel], T_inv[sel], dx[sel])
+    if T.ndim == 2:
+        return (T_inv, local), logdet
+    return T_inv, logdet
+
+# chi2 and log det of T = F F^T + diag(1/prec) with the Woodbury identities,
+# for diagonal precisions prec (D,) or (n,D), prec = 0 for missing features.
+# Also returns T^-1 dx.
+def _woodbury(F, prec, dx):
+    G = prec[...,:,None] * F
+    L = np.matmul(np.swapaxes(G, -1, -2), F) + np.eye(F.shape[-1])
+    u = np.einsum('...dr,...d', G, dx)
+    v = np.linalg.solve(L, u[...,None])[...,0]
+    w = prec * dx - np.einsum('...dr,...r', G, v)
+    chi2 = np.einsum('...i,...i', dx, w)
+    logdet = np.linalg.slogdet(L)[1] - np.log(prec, out=np.zeros(np.shape(prec)), where=prec > 0).sum(axis=-1)
+    return chi2, logdet, w
+
 # get zeroth, first, second moments of the data weighted with p_k(x) avgd over x
-def _Mstep(gmm, U, log_p, T_inv, log_S, H, data, covar=None, R=None, p_bg=None, pool=None, chunksize=1):
+# The sums are stored in buffers of workspace ws, distinguished by tag.
+def _Mstep(gmm, U, log_p, T_inv, log_S, H, data, covar=None, R=None, weights=None, p_bg=None, pool=None, chunksize=1, skip=None, ws=None, tag=""):
 
     # save the M sums from observed data
-    A = np.empty(gmm.K)                 # sum for amplitudes
-    M = np.empty((gmm.K, gmm.D))        # ... means
-    C = np.empty((gmm.K, gmm.D, gmm.D)) # ... covariances
+    if ws is None:
+        ws = _Workspace()
+    A = ws.get("A" + tag, gmm.K)                    # sum for amplitudes
+    M = ws.get("M" + tag, (gmm.K, gmm.D))           # ... means
+    C = ws.get("C" + tag, (gmm.K, gmm.D, gmm.D))    # ... covariances
     N = len(data)
+    log_w = None
+    if weights is not None:
+        # weighted samples count as weights[i] samples
+        log_w = np.log(weights, out=ws.get("log_w" + tag, N))
+        N = weights.sum()
 
     # perform sums for M step in the pool
     # NOTE: in a partial run, could work on changeable components only;
     # however, there seem to be side effects or race conditions
+    # components in skip are set to zero, they must not be updated
     import parmap
-    k = 0
-    for A[k], M[k,:], C[k,:,:] in \
-    parmap.starmap(_Msums, zip(xrange(gmm.K), U, log_p, T_inv), gmm, data, R, log_S, pool=pool, chunksize=chunksize):
-        k += 1
+    if skip is None:
+        ks = np.arange(gmm.K)
+    else:
+        ks = np.flatnonzero(~skip)
+        A[skip], M[skip], C[skip] = 0, 0, 0
+    for k, (A[k], M[k,:], C[k,:,:]) in \
+    zip(ks, parmap.starmap(_Msums, [(k, U[k], log_p[k], T_inv[k]) for k in ks], gmm, data, R, log_S, log_w, pool=pool, chunksize=chunksize)):
+        pass
 
     if p_bg is not None:
-        q_bg = p_bg[0] / np.exp(log_S)
-        B = q_bg.sum() # equivalent to A_k in _Msums, but done without logs
+        q_bg = np.exp(log_S, out=ws.get("q_bg" + tag, len(log_S)))
+        np.divide(p_bg[0], q_bg, out=q_bg)
+        B = q_bg.sum() if weights is None else np.dot(weights, q_bg) # equivalent to A_k in _Msums, but done without logs
     else:
         B = 0
 
     return A,M,C,N,B
 
 # compute moments for the Mstep
-def _Msums(k, U_k, log_p_k, T_inv_k, gmm, data, R, log_S):
+# NOTE: temporary arrays are from the workspace of the process.
+def _Msums(k, U_k, log_p_k, T_inv_k, gmm, data, R, log_S, log_w=None):
     if log_p_k.size == 0:
         return 0,0,0
 
+    ws = _worker_workspace
+    n = log_p_k.size
+
     # get log_q_ik by dividing with S = sum_k p_ik
-    # NOTE:  this modifies log_p_k in place, but is only relevant
-    # within this method since the call is parallel and its arguments
-    # therefore don't get updated across components.
-
-    # NOTE: reshape needed when U_k is None because of its
-    # implicit meaning as np.newaxis
-    log_p_k -= log_S[U_k].reshape(log_p_k.size)
-    d = data[U_k].reshape((log_p_k.size, gmm.D))
+    log_q_k = np.subtract(log_p_k, _take(log_S, U_k, 'log_S', ws), out=ws.get('log_q', n))
+    # weighted samples: q_ik w_i
+    if log_w is not None:
+        log_q_k += _take(log_w, U_k, 'log_w', ws)
+    d = _take(data, U_k, 'd', ws)
     if R is not None:
-        R_ = R[U_k].reshape((log_p_k.size, gmm.D, gmm.D))
+        R_ = _take(R, U_k, 'R', ws)
 
     # amplitude: A_k = sum_i q_ik
-    A_k = np.exp(logsum(log_p_k))
+    A_k = np.exp(logsum(log_q_k, buf=ws.get('logsum', n)))
 
     # in fact: q_ik, but we treat sample index i silently everywhere
-    q_k = np.exp(log_p_k)
+    q_k = np.exp(log_q_k, out=ws.get('q', n))
 
     if R is None:
-        d_m = d - gmm.mean[k]
+        d_m = np.subtract(d, gmm.mean[k], out=ws.get('d_m', (n, gmm.D)))
     else:
-        d_m = d - np.dot(R_, gmm.mean[k])
+        d_m = np.subtract(d, np.dot(R_, gmm.mean[k]), out=ws.get('d_m', (n, gmm.D)))
 
     # data with errors?
-    if T_inv_k is None and R is None:
+    if gmm.covariance_type in ['diag', 'spherical']:
+        # only the diagonal of C_k is needed, with diagonal T_ik^-1:
+        # b_ik = V_k T_ik^-1 (x_i - mu_k), B_ik = V_k - V_k^2 T_ik^-1
+        # for the diagonal V_k = var_k of the component covariance
+        var_k = gmm._diag_var[k]
+        if T_inv_k is None:
+            b_k = d_m
+            B_k = 0
+        else:
+            b_k = np.multiply(var_k * T_inv_k, d_m, out=ws.get('b', (n, gmm.D)))
+            if T_inv_k.ndim == 2:
+                B_k = q_k.sum() * var_k - var_k**2 * np.dot(q_k, T_inv_k)
+            else: # one-for-all
+                B_k = q_k.sum() * (var_k - var_k**2 * T_inv_k)
+        M_k = np.dot(q_k, b_k) + q_k.sum() * gmm.mean[k]
+        C_k = np.diag(np.dot(q_k, b_k**2) + B_k)
+    elif T_inv_k is None and R is None:
         # mean: M_k = sum_i x_i q_ik
-        M_k = (d * q_k[:,None]).sum(axis=0)
+        M_k = np.dot(q_k, d)
 
         # covariance: C_k = sum_i (x_i - mu_k)^T(x_i - mu_k) q_ik
         # funny way of saying: for each point i, do the outer product
         # of d_m with its transpose, multiply with pi[i], and sum over i
-        C_k = (q_k[:, None, None] * d_m[:, :, None] * d_m[:, None, :]).sum(axis=0)
+        C_k = np.dot(np.multiply(d_m, q_k[:,None], out=ws.get('q_d_m', (n, gmm.D))).T, d_m)
+    elif gmm.covariance_type == 'lowrank':
+        # T_ik^-1 = P_i - G_i L_i^-1 G_i^T from Woodbury identities with
+        # diagonal precisions P_i, G_i = P_i F_k, L_i = 1 + F_k^T P_i F_k:
+        # b_ik = C_k T_ik^-1 (x_i - mu_k), B_ik = C_k - C_k T_ik^-1 C_k
+        F, psi, r = gmm.factor[k], gmm.psi[k], gmm.rank
+        G = T_inv_k[...,:,None] * F
+        L_inv = np.linalg.inv(np.matmul(np.swapaxes(G, -1, -2), F) + np.eye(r))
+        GL = np.matmul(G, L_inv)
+        # w_ik = T_ik^-1 (x_i - mu_k), S_k = sum_i q_ik T_ik^-1
+        u = np.einsum('...dr,...d', G, d_m)
+        w_k = T_inv_k * d_m - np.einsum('...dr,...r', GL, u)
+        if T_inv_k.ndim == 1:
+            S_k = q_k.sum() * (np.diag(T_inv_k) - np.dot(GL, G.T))
+        else:
+            S_k = np.diag(np.dot(q_k, T_inv_k))
+            S_k -= np.dot((GL * q_k[:,None,None]).transpose(1,0,2).reshape(gmm.D, n*r), G.transpose(0,2,1).reshape(n*r, gmm.D))
+        b_k = np.dot(np.dot(w_k, F), F.T) + w_k * psi
+        M_k = np.dot(q_k, b_k) + q_k.sum() * gmm.mean[k]
+        C = np.dot(F, F.T)
+        C[np.diag_indices(gmm.D)] += psi
+        C_k = np.dot(np.multiply(b_k, q_k[:,None], out=ws.get('q_d_m', (n, gmm.D))).T, b_k)
+        C_k += q_k.sum() * C - np.dot(np.dot(C, S_k), C)
+    elif isinstance(T_inv_k, tuple):
+        # samples in the same group share T_ik^-1:
+        # b_ik = C_k T_g^-1 (x_i - mu_k), B_g = C_k - C_k T_g^-1 C_k
+        T_inv_g, local = T_inv_k
+        b_k = ws.get('b', (n, gmm.D))
+        C_k = np.zeros((gmm.D, gmm.D))
+        for j, sel in zip(*_groupby(local)):
+            CT = np.dot(gmm.covar[k], T_inv_g[j])
+            b_k[sel] = np.dot(d_m[sel], CT.T)
+            C_k += q_k[sel].sum() * (gmm.covar[k] - np.dot(CT, gmm.covar[k]))
+        M_k = np.dot(q_k, b_k) + q_k.sum() * gmm.mean[k]
+        C_k += np.dot(np.multiply(b_k, q_k[:,None], out=ws.get('q_d_m', (n, gmm.D))).T, b_k)
+    elif T_inv_k.ndim == 3 and _get_jit() is not None:
+        M_k = np.empty(gmm.D)
+        C_k = np.empty((gmm.D, gmm.D))
+        if R is None:
+            R_ = np.empty((0, gmm.D, gmm.D))
+        _get_jit()["moments"](gmm.covar[k], T_inv_k, d_m, q_k, R_, M_k, C_k)
+        M_k += q_k.sum() * gmm.mean[k]
     else:
+        b_k = ws.get('b', (n, gmm.D))
         if R is None: # that means T_ik is not None
             # b_ik = mu_k + C_k T_ik^-1 (x_i - mu_k)
             # B_ik = C_k - C_k T_ik^-1 C_k
-            b_k = gmm.mean[k] + np.einsum('ij,...jk,...k', gmm.covar[k], T_inv_k, d_m)
-            B_k = gmm.covar[k] - np.einsum('ij,...jk,...kl', gmm.covar[k], T_inv_k, gmm.covar[k])
+            np.einsum('ij,...jk,...k', gmm.covar[k], T_inv_k, d_m, out=b_k)
+            B_k = np.einsum('ij,...jk,...kl', gmm.covar[k], T_inv_k, gmm.covar[k], out=ws.get('B', T_inv_k.shape))
         else:
             # F_ik = C_k R_i^T T_ik^-1
-            F_k = np.einsum('ij,...kj,...kl', gmm.covar[k], R_, T_inv_k)
-            b_k = gmm.mean[k] + np.einsum('...ij,...j', F_k, d_m)
-            B_k = gmm.covar[k] - np.einsum('...ij,...jk,kl', F_k, R_, gmm.covar[k])
-
-            #b_k = gmm.mean[k] + np.einsum('ij,...jk,...k', gmm.covar[k], T_inv_k, d_m)
-            #B_k = gmm.covar[k] - np.einsum('ij,...jk,...kl', gmm.covar[k], T_inv_k, gmm.covar[k])
-        M_k = (b_k * q_k[:,None]).sum(axis=0)
+            F_k = np.einsum('ij,...kj,...kl', gmm.covar[k], R_, T_inv_k, out=ws.get('F', (n, gmm.D, gmm.D)))
+            np.einsum('...ij,...j', F_k, d_m, out=b_k)
+            B_k = np.einsum('...ij,...jk,kl', F_k, R_, gmm.covar[k], out=ws.get('B', (n, gmm.D, gmm.D)))
+        b_k += gmm.mean[k]
+        np.subtract(gmm.covar[k], B_k, out=B_k)
+        M_k = np.dot(q_k, b_k)
         b_k -= gmm.mean[k]
-        C_k = (q_k[:, None, None] * (b_k[:, :, None] * b_k[:, None, :] + B_k)).sum(axis=0)
+        C_k = np.dot(np.multiply(b_k, q_k[:,None], out=ws.get('q_d_m', (n, gmm.D))).T, b_k)
+        if B_k.ndim == 3:
+            C_k += np.einsum('i,ijk', q_k, B_k)
+        else: # one-for-all
+            C_k += q_k.sum() * B_k
     return A_k, M_k, C_k
 
 
@@ -1082,9 +2903,33 @@ def _update(gmm, A, M, C, N, B, H, A2, M2, C2, N2, B2, H2, w, changeable=None, b
         # prefactor 1 / (q_j + 1) = 1 / (A + 1) in our terminology
         # On average, q_j = N/K, so we'll adopt that to correct.
         w_eff = w**2 * ((N+N2)/gmm.K + 1)
-        gmm.covar[changeable['covar'],:,:] = (C + C2 + w_eff*np.eye(gmm.D)[None,:,:])[changeable['covar'],:,:] / (A + A2 + 1)[changeable['covar'],None,None]
+        covar = (C + C2 + w_eff*np.eye(gmm.D)[None,:,:])[changeable['covar'],:,:] / (A + A2 + 1)[changeable['covar'],None,None]
     else:
-        gmm.covar[changeable['covar'],:,:] = (C + C2)[changeable['covar'],:,:] / (A + A2)[changeable['covar'],None,None]
+        covar = (C + C2)[changeable['covar'],:,:] / (A + A2)[changeable['covar'],None,None]
+    k = changeable['covar']
+    if gmm.covariance_type == 'lowrank':
+        gmm.factor[k], gmm.psi[k] = _factor_step(gmm.factor[k], gmm.psi[k], covar)
+    elif gmm.covariance_type == 'tied':
+        # shared covariance: average of the component covariances, weighted
+        # with their amplitudes
+        if len(covar):
+            gmm.tied_covar[:,:] = np.average(covar, axis=0, weights=(A + A2)[k])
+    else:
+        gmm._set_covar(k, covar)
+
+# one EM step of factor analysis (Ghahramani & Hinton 1996) for components
+# with second moments S (K,D,D), given the current factor F (K,D,r) and psi (K,D)
+def _factor_step(F, psi, S):
+    # beta = F^T (F F^T + psi)^-1, with Woodbury identities
+    G = F / psi[:,:,None]
+    L = np.matmul(np.swapaxes(F, -1, -2), G) + np.eye(F.shape[-1])
+    beta = np.linalg.solve(L, np.swapaxes(G, -1, -2))
+    S_beta = np.matmul(S, np.swapaxes(beta, -1, -2))
+    # E[z z^T] = 1 - beta F + beta S beta^T, F = S beta^T E[z z^T]^-1
+    Ezz = np.eye(F.shape[-1]) - np.matmul(beta, F) + np.matmul(beta, S_beta)
+    F_ = np.swapaxes(np.linalg.solve(Ezz, np.swapaxes(S_beta, -1, -2)), -1, -2)
+    psi_ = np.diagonal(S, axis1=-2, axis2=-1) - (F_ * S_beta).sum(axis=-1)
+    return F_, psi_
 
 # draw from the model (+ background) and apply appropriate covariances
 def _drawGMM_BG(gmm, size, covar_callback=None, background=None, rng=np.random):
@@ -1231,13 +3076,7 @@ def _findSNMComponents(gmm, U, log_p, log_S, N, pool=None, chunksize=1):
         k += 1
     """
     # get largest Eigenvalue, weighed by amplitude
-    # Large EV implies extended object, which often is caused by coverving
-    # multiple clusters. This happes also for almost empty components, which
-    # should rather be merged than split, hence amplitude weights.
-    # TODO: replace with linalg.eigvalsh, but eigenvalues are not always ordered
-    EV = np.linalg.svd(gmm.covar, compute_uv=False)
-    JS = EV[:,0] * gmm.amp
-    split_l3 = np.argsort(JS)[-3:][::-1]
+    split_l3 = _split_candidates(gmm)[:3]
 
     # check that the three indices are unique
     changing = np.array([merge_jk[0], merge_jk[1], split_l3[0]])
@@ -1249,42 +3088,162 @@ def _findSNMComponents(gmm, U, log_p, log_S, N, pool=None, chunksize=1):
     return changing, cleanup
 
 
-def _update_snm(gmm, changeable, U, N, cleanup):
-    # reconstruct A from gmm.amp
-    A = gmm.amp * N
+def _split_candidates(gmm):
+    # component indices, ordered by how much they should be split:
+    # largest Eigenvalue, weighed by amplitude.
+    # Large EV implies extended object, which often is caused by coverving
+    # multiple clusters. This happes also for almost empty components, which
+    # should rather be merged than split, hence amplitude weights.
+    # TODO: replace with linalg.eigvalsh, but eigenvalues are not always ordered
+    EV = np.linalg.svd(gmm.covar, compute_uv=False)
+    JS = EV[:,0] * gmm.amp
+    return np.argsort(JS)[::-1]
 
-    # update parameters and U
-    # merge 0 and 1, store in 0, Bovy eq. 39
-    gmm.amp[changeable[0]] = gmm.amp[changeable[0:2]].sum()
+
+def _merge_components(gmm, k, j, A, U=None, cleanup=False):
+    # merge k and j, store in k, Bovy eq. 39
+    gmm.amp[k] = gmm.amp[[k,j]].sum()
     if not cleanup:
-        gmm.mean[changeable[0]] = np.sum(gmm.mean[changeable[0:2]] * A[changeable[0:2]][:,None], axis=0) / A[changeable[0:2]].sum()
-        gmm.covar[changeable[0]] = np.sum(gmm.covar[changeable[0:2]] * A[changeable[0:2]][:,None,None], axis=0) / A[changeable[0:2]].sum()
-        U[changeable[0]] = np.union1d(U[changeable[0]], U[changeable[1]])
+        gmm.mean[k] = np.sum(gmm.mean[[k,j]] * A[[k,j]][:,None], axis=0) / A[[k,j]].sum()
+        gmm._set_covar(k, np.sum(gmm.covar[[k,j]] * A[[k,j]][:,None,None], axis=0) / A[[k,j]].sum())
+        if U is not None:
+            U[k] = np.union1d(U[k], U[j])
     else:
         # if we're cleaning up the weakest components:
         # merging does not lead to valid component parameters as the original
         # ones can be anywhere. Simply adopt second one.
-        gmm.mean[changeable[0],:] = gmm.mean[changeable[1],:]
-        gmm.covar[changeable[0],:,:] = gmm.covar[changeable[1],:,:]
-        U[changeable[0]] = U[changeable[1]]
+        gmm.mean[k,:] = gmm.mean[j,:]
+        gmm._set_covar(k, gmm.covar[j])
+        if U is not None:
+            U[k] = U[j]
 
-    # split 2, store in 1 and 2
+
+def _split_component(gmm, k, j, U=None):
+    # split k, store in j and k
     # following SVD method in Zhang 2003, with alpha=1/2, u = 1/4
-    gmm.amp[changeable[1]] = gmm.amp[changeable[2]] = gmm.amp[changeable[2]] / 2
+    gmm.amp[j] = gmm.amp[k] = gmm.amp[k] / 2
     # TODO: replace with linalg.eigvalsh, but eigenvalues are not always ordered
-    _, radius2, rotation = np.linalg.svd(gmm.covar[changeable[2]])
+    _, radius2, rotation = np.linalg.svd(gmm.covar[k])
     dl = np.sqrt(radius2[0]) *  rotation[0] / 4
-    gmm.mean[changeable[1]] = gmm.mean[changeable[2]] - dl
-    gmm.mean[changeable[2]] = gmm.mean[changeable[2]] + dl
-    gmm.covar[changeable[1:]] = np.linalg.det(gmm.covar[changeable[2]])**(1/gmm.D) * np.eye(gmm.D)
-    U[changeable[1]] = U[changeable[2]].copy() # now 1 and 2 have same U
+    gmm.mean[j] = gmm.mean[k] - dl
+    gmm.mean[k] = gmm.mean[k] + dl
+    # a tied covariance is shared with all other components and kept
+    if gmm.covariance_type != 'tied':
+        gmm._set_covar([j,k], np.linalg.det(gmm.covar[k])**(1/gmm.D) * np.eye(gmm.D))
+    if U is not None:
+        U[j] = U[k].copy() # now j and k have same U
+
+
+def _update_snm(gmm, changeable, U, N, cleanup):
+    # reconstruct A from gmm.amp
+    A = gmm.amp * N
+
+    # update parameters and U
+    # merge 0 and 1, store in 0
+    _merge_components(gmm, changeable[0], changeable[1], A, U=U, cleanup=cleanup)
+
+    # split 2, store in 1 and 2
+    _split_component(gmm, changeable[2], changeable[1], U=U)
+
+
+def _copy_gmm(gmm):
+    # independent copy of gmm, e.g. for concurrent fits
+    gmm_ = GMM(K=gmm.K, D=gmm.D, covariance_type=gmm.covariance_type, rank=gmm.rank)
+    _copy_params(gmm_, gmm)
+    return gmm_
+
+def _copy_params(gmm_, gmm):
+    # copy all parameters of gmm into gmm_ of the same size and type
+    gmm_.amp[:] = gmm.amp[:]
+    gmm_.mean[:,:] = gmm.mean[:,:]
+    for name in gmm._covar_params:
+        getattr(gmm_, name)[...] = getattr(gmm, name)
+
+
+def _cv_processes(L, processes=None):
+    # split the core budget between concurrent folds and the pool work
+    # within each fold's fit
+    if processes is None:
+        import multiprocessing
+        processes = multiprocessing.cpu_count()
+    n_folds = max(1, min(L, processes))
+    return processes, n_folds, max(1, processes // n_folds)
+
+
+def _fit_copy(gmm0, data, rng_state, kwargs, covar=None, pool=None, processes=None):
+    # fit a copy of gmm0 to data.
+    # every call gets its own RNG and background, both starting from the same
+    # state, so that concurrent fits don't interfere
+    gmm = _copy_gmm(gmm0)
+    kwargs = dict(kwargs)
+    rng = np.random.RandomState()
+    rng.set_state(rng_state)
+    kwargs['rng'] = rng
+    bg = kwargs.get("background", None)
+    if bg is not None:
+        import copy
+        bg = kwargs['background'] = copy.deepcopy(bg)
+    log_L, U = fit(gmm, data, covar=covar, pool=pool, processes=processes, **kwargs)
+    return gmm, bg, log_L
+
+
+def _cv_fold(gmm0, data, mask, rng_state, kwargs, covar=None, pool=None, processes=None):
+    # fit a copy of gmm0 to all samples outside of mask, evaluate on mask.
+    covar_index = kwargs.get("covar_index", None)
+    index_out = None
+    if covar_index is not None: # covar is a table: split the index instead
+        covar_in = covar_out = covar
+        kwargs = dict(kwargs, covar_index=covar_index[~mask])
+        index_out = covar_index[mask]
+    elif covar is None or covar.shape == (gmm0.D, gmm0.D):
+        covar_in = covar_out = covar
+    else:
+        covar_in, covar_out = covar[~mask], covar[mask]
+    if kwargs.get("weights", None) is not None:
+        kwargs = dict(kwargs, weights=kwargs["weights"][~mask])
+    gmm, bg, log_L = _fit_copy(gmm0, data[~mask], rng_state, kwargs, covar=covar_in, pool=pool, processes=processes)
+    return gmm.logL(data[mask], covar=covar_out, covar_index=index_out, pool=pool, processes=processes)
+
+
+def _checkpoint_kwargs(kwargs, name):
+    # fit arguments for one of several concurrent fits: its checkpoint is the
+    # subdirectory name, so that the fits neither overwrite nor resume each
+    # other's state
+    if kwargs.get("checkpoint", None) is None:
+        return kwargs
+    import os
+    return dict(kwargs, checkpoint=os.path.join(kwargs["checkpoint"], name))
+
+
+def _warm_kwargs(kwargs, bg, L):
+    # fit arguments for L folds that start from the fit to all data (with
+    # background bg). The re-fit on the training part converges within tol/L:
+    # with tol, it stops after few iterations close to the starting point,
+    # which has seen the held-out samples.
+    kwargs = dict(kwargs, init_method='none', tol=kwargs.get("tol", 1e-3) / L)
+    if bg is not None:
+        kwargs['background'] = bg
+    return kwargs
 
 
 # L-fold cross-validation of the fit function.
 # all parameters for fit must be supplied with kwargs.
 # the rng seed will be fixed for the CV runs so that all random effects are the
 # same for each run.
-def cv_fit(gmm, data, L=10, **kwargs):
+# The folds run concurrently in threads that share one process pool: the
+# available processes are split between the number of concurrent folds and
+# the parallelism within each fit.
+# With warm_start, all data are fit first, and each fold starts from that
+# solution with init_method='none' and is re-fit on its training part within
+# tol/L, so that it does not stop close to the fit to all data, which has seen
+# the held-out samples. The folds still stay in the basin of that fit.
+# WARNING: warm_start=True biases the CV scores upward, by more than tol: for
+# 2000 samples from 4 components in 3 dimensions, the mean CV log-likelihood
+# was 0.011 +- 0.005 higher than without warm_start. Only compare scores that
+# were computed with the same warm_start setting.
+# With checkpoint, fold i stores its state in the subdirectory str(i), and the
+# fit to all data in 'all'.
+def cv_fit(gmm, data, L=10, processes=None, warm_start=False, **kwargs):
     N = len(data)
     lcv = np.empty(N)
     logger.info("running %d-fold cross-validation ..." % L)
@@ -1296,40 +3255,41 @@ def cv_fit(gmm, data, L=10, **kwargs):
         raise RuntimeError("Cross-validation can only be used consistently with init_callback=None")
 
     # make sure we know what the RNG is,
-    # fix state of RNG to make behavior of fit reproducable
-    rng = kwargs.get("rng", np.random)
+    # fix state of RNG to make behavior of fit reproducable:
+    # each fold starts from the same state
+    rng = kwargs.pop("rng", np.random)
     rng_state = rng.get_state()
 
     # need to copy the gmm when init_cb is None
-    # otherwise runs start from different init positions
-    gmm0 = GMM(K=gmm.K, D=gmm.D)
-    gmm0.amp[:,] = gmm.amp[:]
-    gmm0.mean[:,:] = gmm.mean[:,:]
-    gmm0.covar[:,:,:] = gmm.covar[:,:,:]
-
-    # same for bg if present
-    bg = kwargs.get("background", None)
-    if bg is not None:
-        bg_amp0 = bg.amp
+    # otherwise runs start from different init positions.
+    # gmm itself is not altered by the folds
+    gmm0 = _copy_gmm(gmm)
+
+    # shared pool for all folds
+    processes, n_folds, fold_processes = _cv_processes(L, processes)
+    pool = kwargs.pop("pool", None)
+    own_pool = pool is None
+    if own_pool:
+        import multiprocessing
+        pool = multiprocessing.Pool(processes=processes)
 
     # to L-fold CV here, need to split covar too if set
     covar = kwargs.pop("covar", None)
-    for i in xrange(L):
-        rng.set_state(rng_state)
-        mask = np.arange(N) % L == i
-        if covar is None or covar.shape == (gmm.D, gmm.D):
-            fit(gmm, data[~mask], covar=covar, **kwargs)
-            lcv[mask] = gmm.logL(data[mask], covar=covar)
-        else:
-            fit(gmm, data[~mask], covar=covar[~mask], **kwargs)
-            lcv[mask] = gmm.logL(data[mask], covar=covar[mask])
-
-        # undo for consistency
-        gmm.amp[:,] = gmm0.amp[:]
-        gmm.mean[:,:] = gmm0.mean[:,:]
-        gmm.covar[:,:,:] = gmm0.covar[:,:,:]
-        if bg is not None:
-            bg.amp = bg_amp0
+    if warm_start:
+        gmm0, bg, log_L = _fit_copy(gmm0, data, rng_state, _checkpoint_kwargs(kwargs, "all"), covar=covar, pool=pool, processes=processes)
+        kwargs = _warm_kwargs(kwargs, bg, L)
+
+    masks = [np.arange(N) % L == i for i in xrange(L)]
+    from multiprocessing.pool import ThreadPool
+    folds = ThreadPool(processes=n_folds)
+    results = [folds.apply_async(_cv_fold, (gmm0, data, masks[i], rng_state, _checkpoint_kwargs(kwargs, str(i))), dict(covar=covar, pool=pool, processes=fold_processes)) for i in xrange(L)]
+    try:
+        for mask, r in zip(masks, results):
+            lcv[mask] = r.get()
+    finally:
+        folds.close()
+        if own_pool:
+            pool.close()
 
     return lcv
 
@@ -1345,18 +3305,105 @@ def stack(gmms, weights):
     return stacked
 
 
-def stack_fit(gmms, data, kwargs, L=10, tol=1e-5, rng=np.random):
+# Stacking of M models, each with L-fold cross-validation.
+# All M*(L+1) fits are scheduled as a task graph on threads that share one
+# process pool; the stacking weights are computed once all folds have finished.
+# If kwargs[m]["warm_start"] is set, the folds of model m depend on, and start
+# from, the fit of model m to all data (see cv_fit). This biases the CV scores
+# of model m upward, and with it its stacking weight relative to models
+# without warm_start: set warm_start for all models or for none.
+# All fits of model m start from the same RNG state, namely that of
+# kwargs[m]["rng"] (or rng, if not set) at the time of the call.
+# With kwargs[m]["checkpoint"], the fits of model m store their state in its
+# subdirectories str(m)/str(i) for fold i and str(m)/all for all data.
+# Results of finished fits are stored in state (a dict, keyed by task) if it is
+# given. If any fit fails, a RuntimeError is raised after all others have
+# finished, and calling stack_fit again with the same state only reruns the
+# fits that are missing.
+def stack_fit(gmms, data, kwargs, L=10, tol=1e-5, rng=np.random, processes=None, state=None):
     M = len(gmms)
     N = len(data)
     lcvs = np.empty((M,N))
+    if state is None:
+        state = {}
+
+    # set up task graph: L folds and one full fit per model.
+    # each task is (key, key of task it depends on, callable that creates the
+    # fit function and its arguments from the state).
+    masks = [np.arange(N) % L == i for i in xrange(L)]
+    tasks = []
+    for m in xrange(M):
+        kwargs_ = dict(kwargs[m])
+        rng_state = kwargs_.pop("rng", rng).get_state()
+        covar = kwargs_.pop("covar", None)
+        warm_start = kwargs_.pop("warm_start", False)
+        for key in ["pool", "processes"]:
+            kwargs_.pop(key, None)
+        kwargs_ = _checkpoint_kwargs(kwargs_, str(m))
+        gmm0 = _copy_gmm(gmms[m])
+        tasks.append(((m, None), None, lambda state, gmm0=gmm0, kwargs_=kwargs_, rng_state=rng_state, covar=covar:
+                      (_fit_copy, (gmm0, data, rng_state, _checkpoint_kwargs(kwargs_, "all")), {"covar": covar})))
+        for i in xrange(L):
+            if warm_start:
+                def make(state, m=m, i=i, kwargs_=kwargs_, rng_state=rng_state, covar=covar):
+                    gmm, bg, log_L = state[(m, None)]
+                    return _cv_fold, (gmm, data, masks[i], rng_state, _checkpoint_kwargs(_warm_kwargs(kwargs_, bg, L), str(i))), {"covar": covar}
+                tasks.append(((m, i), (m, None), make))
+            else:
+                tasks.append(((m, i), None, lambda state, gmm0=gmm0, i=i, kwargs_=kwargs_, rng_state=rng_state, covar=covar:
+                              (_cv_fold, (gmm0, data, masks[i], rng_state, _checkpoint_kwargs(kwargs_, str(i))), {"covar": covar})))
 
+    # run all that haven't been done yet, collect results as they are needed:
+    # fits to all data first, so that the folds that depend on them can start
+    import multiprocessing
+    from multiprocessing.pool import ThreadPool
+    todo = [task for task in tasks if task[0] not in state]
+    processes, n_fits, fit_processes = _cv_processes(len(todo), processes)
+    logger.info("running %d of %d stacking fits ..." % (len(todo), len(tasks)))
+    failed = []
+
+    def _submit(task):
+        key, dep, make = task
+        func, args, kw = make(state)
+        kw = dict(kw, pool=pool, processes=fit_processes)
+        return task, fits.apply_async(func, args, kw)
+
+    if len(todo):
+        pool = multiprocessing.Pool(processes=processes)
+        fits = ThreadPool(processes=n_fits)
+        try:
+            running = [_submit(task) for task in todo if task[1] is None or task[1] in state]
+            waiting = [task for task in todo if task[1] is not None and task[1] not in state]
+            running.sort(key=lambda item: item[0][0][1] is not None)
+            while len(running):
+                (key, dep, make), r = running.pop(0)
+                try:
+                    state[key] = r.get()
+                except Exception as error:
+                    failed.append(key)
+                    logger.warning("stacking fit %r failed: %r" % (key, error))
+                logger.info("stacking fits: %d/%d done" % (sum(task[0] in state for task in tasks), len(tasks)))
+                for task in waiting:
+                    if task[1] == key:
+                        if key in state:
+                            running.append(_submit(task))
+                        else:
+                            # dependent fits can't run either
+                            failed.append(task[0])
+        finally:
+            fits.close()
+            pool.close()
+    if len(failed):
+        raise RuntimeError("%d stacking fits failed; call stack_fit with the same state to resume" % len(failed))
+
+    # collect results
     for m in xrange(M):
-        # run CV to get cross-validation likelihood
-        rng_state = rng.get_state()
-        lcvs[m,:] = cv_fit(gmms[m], data, L=L, **(kwargs[m]))
-        rng.set_state(rng_state)
-        # run normal fit on all data
-        fit(gmms[m], data, **(kwargs[m]))
+        for i in xrange(L):
+            lcvs[m, masks[i]] = state[(m, i)]
+        gmm, bg, log_L = state[(m, None)]
+        _copy_params(gmms[m], gmm)
+        if bg is not None:
+            kwargs[m]["background"].amp = bg.amp
 
     # determine the weights that maximize the stacked estimator likelihood
     # run a tiny EM on lcvs to get them
@@ -1380,3 +3427,411 @@ def stack_fit(gmms, data, kwargs, L=10, tol=1e-5, rng=np.random):
         logL = logL_
         it += 1
     return stack(gmms, beta)
+
+
+def _grow_gmm(gmm):
+    # copy of gmm with one more component, by splitting the worst one
+    gmm_ = _take_components(gmm, np.arange(gmm.K+1) % gmm.K)
+    _split_component(gmm_, _split_candidates(gmm)[0], gmm.K)
+    return gmm_
+
+
+def _shrink_gmm(gmm):
+    # copy of gmm with one less component, by merging the closest pair
+    dmean = gmm.mean[:,None,:] - gmm.mean[None,:,:]
+    chi2 = np.einsum('...i,...ij,...j', dmean, np.linalg.inv(gmm.covar[:,None,:,:] + gmm.covar[None,:,:,:]), dmean)
+    chi2[np.tril_indices(gmm.K)] = np.inf
+    k, j = np.unravel_index(chi2.argmin(), chi2.shape)
+    gmm_ = _copy_gmm(gmm)
+    _merge_components(gmm_, k, j, gmm.amp)
+    return _take_components(gmm_, np.flatnonzero(np.arange(gmm.K) != j))
+
+
+# copy of gmm with the components in index
+def _take_components(gmm, index):
+    gmm_ = GMM(K=len(index), D=gmm.D, covariance_type=gmm.covariance_type, rank=gmm.rank)
+    gmm_.amp[:] = gmm.amp[index]
+    gmm_.mean[:,:] = gmm.mean[index]
+    for name in gmm._covar_params:
+        if name == 'tied_covar': # shared by all components
+            gmm_.tied_covar[:,:] = gmm.tied_covar
+        else:
+            getattr(gmm_, name)[...] = getattr(gmm, name)[index]
+    return gmm_
+
+
+def _n_params(gmm, background=None):
+    # number of free parameters of the model
+    n = (gmm.K - 1) + gmm.K * gmm.D
+    if gmm.covariance_type == 'lowrank':
+        # factor is unique up to rotations of the latent space
+        n += gmm.K * (gmm.D * (gmm.rank + 1) - gmm.rank * (gmm.rank - 1) // 2)
+    elif gmm.covariance_type == 'diag':
+        n += gmm.K * gmm.D
+    elif gmm.covariance_type == 'spherical':
+        n += gmm.K
+    elif gmm.covariance_type == 'tied':
+        n += gmm.D * (gmm.D + 1) // 2
+    else:
+        n += gmm.K * gmm.D * (gmm.D + 1) // 2
+    if background is not None and background.adjust_amp:
+        n += 1
+    return n
+
+
+def fit_K_range(data, Ks, criterion='bic', warm_start=True, L=10, covariance_type='full', rank=None, processes=None, **kwargs):
+    """Fit GMMs for a range of component numbers K and score them.
+
+    With warm_start, the median K is fit first (with the init_method from
+    kwargs). From there, each larger K starts from the previous solution with
+    its worst component split, and each smaller K from the previous solution
+    with its closest pair merged. Both sequences run concurrently.
+    Without warm_start, all K are fit independently and concurrently.
+    All fits share one process pool, and all start from the same RNG state.
+    With checkpoint, the fit for K stores its state in the subdirectory str(K).
+    For criterion 'heldout', the held-out samples are excluded from all fits,
+    including those that provide the warm starts, so unlike cv_fit with
+    warm_start, the scores are not biased by them.
+
+    Args:
+        data: numpy array (N,D)
+        Ks (iterable): component numbers to fit
+        criterion (string): one of ['bic', 'aic', 'heldout']
+        warm_start (bool): whether to initialize from neighboring K
+        L (int): for criterion 'heldout', every L-th sample is held out from
+            the fit and used for the score
+        covariance_type (str): covariance type of the GMMs, see GMM
+        rank (int): rank of the factors for covariance_type 'lowrank'
+        processes (int): number of processes to use, defaults to all
+        kwargs: additional arguments for fit()
+
+    Returns:
+        list of GMMs, numpy array of scores, both ordered like sorted(Ks).
+        Scores are BIC or AIC (lower is better), or the mean log-likelihood
+        of the held-out samples (higher is better).
+
+    Throws:
+        NotImplementedError for unknown criterion
+    """
+    criterion = criterion.lower()
+    if criterion not in ['bic', 'aic', 'heldout']:
+        raise NotImplementedError("criterion %s not in ['bic', 'aic', 'heldout']" % criterion)
+    Ks = sorted(Ks)
+    N, D = data.shape
+
+    rng = kwargs.pop("rng", np.random)
+    rng_state = rng.get_state()
+    covar = kwargs.pop("covar", None)
+    if criterion == 'heldout':
+        mask = np.arange(N) % L == 0
+    else:
+        mask = np.zeros(N, dtype='bool')
+    data_in, data_out = data[~mask], data[mask]
+    covar_index = kwargs.get("covar_index", None)
+    index_out = None
+    if covar_index is not None: # covar is a table: split the index instead
+        covar_in = covar_out = covar
+        kwargs["covar_index"] = covar_index[~mask]
+        index_out = covar_index[mask]
+    elif covar is None or covar.shape == (D, D):
+        covar_in = covar_out = covar
+    else:
+        covar_in, covar_out = covar[~mask], covar[mask]
+    N_in = len(data_in)
+    weights = kwargs.get("weights", None)
+    weights_out = None
+    if weights is not None: # weighted samples count as weights[i] samples
+        kwargs["weights"] = weights[~mask]
+        weights_out = weights[mask]
+        N_in = kwargs["weights"].sum()
+
+    import multiprocessing
+    from multiprocessing.pool import ThreadPool
+    pool = kwargs.pop("pool", None)
+    own_pool = pool is None
+    if own_pool:
+        pool = multiprocessing.Pool(processes=processes)
+
+    def _fit_K(gmm0, kwargs_, processes_):
+        kwargs_ = _checkpoint_kwargs(kwargs_, str(gmm0.K))
+        gmm, bg, log_L = _fit_copy(gmm0, data_in, rng_state, kwargs_, covar=covar_in, pool=pool, processes=processes_)
+        if criterion == 'heldout':
+            score = np.average(gmm.logL(data_out, covar=covar_out, covar_index=index_out, pool=pool, processes=processes_), weights=weights_out)
+        elif criterion == 'bic':
+            score = -2 * N_in * log_L + _n_params(gmm, bg) * np.log(N_in)
+        else:
+            score = -2 * N_in * log_L + 2 * _n_params(gmm, bg)
+        logger.info("K=%d\t%s=%.3f" % (gmm.K, criterion.upper(), score))
+        return gmm, bg, score
+
+    def _fit_sequence(Ks_, gmm, bg, processes_):
+        results = []
+        for K in Ks_:
+            gmm0 = gmm
+            while gmm0.K < K:
+                gmm0 = _grow_gmm(gmm0)
+            while gmm0.K > K:
+                gmm0 = _shrink_gmm(gmm0)
+            kwargs_ = dict(kwargs, init_method='none')
+            if bg is not None:
+                kwargs_['background'] = bg
+            gmm, bg, score = _fit_K(gmm0, kwargs_, processes_)
+            results.append((gmm, score))
+        return results
+
+    results = {}
+    try:
+        if warm_start:
+            i = len(Ks) // 2
+            processes, n_seq, seq_processes = _cv_processes(2, processes)
+            gmm, bg, score = _fit_K(GMM(K=Ks[i], D=D, covariance_type=covariance_type, rank=rank), kwargs, processes)
+            results[Ks[i]] = (gmm, score)
+            seqs = ThreadPool(processes=n_seq)
+            sequences = [seqs.apply_async(_fit_sequence, (Ks_, gmm, bg, seq_processes)) for Ks_ in [Ks[i+1:], Ks[:i][::-1]]]
+            for Ks_, r in zip([Ks[i+1:], Ks[:i][::-1]], sequences):
+                results.update(zip(Ks_, r.get()))
+            seqs.close()
+        else:
+            processes, n_fits, fit_processes = _cv_processes(len(Ks), processes)
+            fits = ThreadPool(processes=n_fits)
+            rs = [fits.apply_async(_fit_K, (GMM(K=K, D=D, covariance_type=covariance_type, rank=rank), kwargs, fit_processes)) for K in Ks]
+            for K, r in zip(Ks, rs):
+                gmm, bg, score = r.get()
+                results[K] = (gmm, score)
+            fits.close()
+    finally:
+        if own_pool:
+            pool.close()
+
+    return [results[K][0] for K in Ks], np.array([results[K][1] for K in Ks])
+
+
+def fit_restarts(gmm, data, n_init=10, probe_iter=5, prune=0.1, processes=None, rng=np.random, **kwargs):
+    """Fit GMM to data from several random initializations, keep the best.
+
+    All restarts run concurrently on one process pool. Each restart has its
+    own numpy.random.RandomState, seeded from rng, so that results are
+    reproducible. After probe_iter iterations, restarts whose mean
+    log-likelihood is worse than the best by more than prune are stopped,
+    the others continue until convergence.
+
+    The probe phase runs plain EM: split_n_merge, multires, and checkpoint
+    are only used in the continue phase. That phase starts a new fit (with
+    init_method='none') from the probed parameters, so the neighborhoods,
+    SQUAREM history, and frozen components of the probe are not kept.
+    With checkpoint, restart r stores its state in the subdirectory str(r),
+    and resume continues each restart from its own state.
+
+    Args:
+        gmm: an instance if GMM, will be set to the best restart
+        data: numpy array (N,D)
+        n_init (int): number of restarts
+        probe_iter (int): number of EM iterations before pruning
+        prune (float): tolerance in mean log-likelihood for pruning,
+            no pruning if None
+        processes (int): number of processes to use, defaults to all
+        rng: numpy.random.RandomState for deterministic behavior
+        kwargs: additional arguments for fit()
+
+    Returns:
+        mean log-likelihood (float) and component neighborhoods (list of ints)
+        of the best restart, mean log-likelihoods of all restarts (numpy
+        array, for pruned restarts the value after probe_iter iterations)
+    """
+    if kwargs.get("init_method", "random").lower() == 'none':
+        raise RuntimeError("fit_restarts needs a random init_method")
+    maxiter = kwargs.pop("maxiter", None)
+    bg = kwargs.pop("background", None)
+
+    # restarts own their model, background, and RNG
+    import copy
+    seeds = rng.randint(np.iinfo(np.int32).max, size=n_init)
+    gmms = [_copy_gmm(gmm) for r in xrange(n_init)]
+    bgs = [copy.deepcopy(bg) for r in xrange(n_init)]
+    rngs = [np.random.RandomState(seed) for seed in seeds]
+
+    import multiprocessing
+    from multiprocessing.pool import ThreadPool
+    processes, n_fits, fit_processes = _cv_processes(n_init, processes)
+    pool = kwargs.pop("pool", None)
+    own_pool = pool is None
+    if own_pool:
+        pool = multiprocessing.Pool(processes=processes)
+    fits = ThreadPool(processes=n_fits)
+
+    def _run(restarts, kwargs_):
+        rs = [fits.apply_async(fit, (gmms[r], data), dict(_checkpoint_kwargs(kwargs_, str(r)), background=bgs[r], rng=rngs[r], pool=pool, processes=fit_processes)) for r in restarts]
+        for r, res in zip(restarts, rs):
+            log_Ls[r], Us[r] = res.get()
+
+    log_Ls = np.empty(n_init)
+    Us = [None for r in xrange(n_init)]
+    try:
+        # probe phase
+        restarts = np.arange(n_init)
+        if probe_iter is not None and (maxiter is None or probe_iter < maxiter):
+            _run(restarts, dict(kwargs, maxiter=probe_iter, split_n_merge=False, multires=None, checkpoint=None))
+            if prune is not None:
+                restarts = np.flatnonzero(log_Ls >= log_Ls.max() - prune)
+            logger.info("continuing restarts " + ("%d," * restarts.size) % tuple(restarts))
+            kwargs = dict(kwargs, init_method='none')
+            if maxiter is not None:
+                maxiter -= probe_iter
+        _run(restarts, dict(kwargs, maxiter=maxiter))
+    finally:
+        fits.close()
+        if own_pool:
+            pool.close()
+
+    best = restarts[np.argmax(log_Ls[restarts])]
+    logger.info("best restart %d with log_L=%.3f" % (best, log_Ls[best]))
+    _copy_params(gmm, gmms[best])
+    if bg is not None:
+        bg.amp = bgs[best].amp
+    return log_Ls[best], Us[best], log_Ls
+
+
+def coreset(gmm, data, size, covar=None, covar_index=None, weights=None, pool=None, processes=None, rng=np.random):
+    """Weighted subset of data that approximates the likelihood of GMMs.
+
+    Samples are drawn with replacement, with probabilities proportional to
+    an upper bound of their sensitivity, i.e. their largest possible share of
+    the log-likelihood. The bound is computed from the rough model gmm (see
+    Algorithm 2 of Lucic et al. 2018, arXiv:1703.08110): each sample is
+    assigned to its most likely component, and the bound grows with its chi2
+    with respect to that component, the mean chi2 of that component, and the
+    inverse of the number of samples assigned to that component. The weights
+    are the inverse probabilities, so that sums over the coreset are unbiased
+    estimates of the sums over data. For a size that grows as epsilon^-2, the
+    log-likelihood of any GMM on the coreset is within a factor 1 +- epsilon
+    of that on data with high probability.
+
+    Args:
+        gmm: an instance of GMM, the rough model
+        data: numpy array (N,D), without missing features
+        size (int): number of draws, samples drawn repeatedly are merged
+        covar: sample noise covariance; numpy array (N,D,D) or (D,D) if i.i.d.,
+            or (C,D,D) table of unique covariances if covar_index is set
+        covar_index: numpy array (N,) of indices into the covar table
+        weights: numpy array (N,) of positive sample weights
+        pool: multiprocessing.Pool to use, will be created if None
+        processes (int): number of processes to use, defaults to all
+        rng: numpy.random.RandomState for deterministic behavior
+
+    Returns:
+        numpy array of sample indices into data, and numpy array of their
+        weights, for use with fit(..., weights=weights)
+    """
+    N = len(data)
+    per_sample = covar_index is None and covar is not None and covar.shape != (gmm.D, gmm.D)
+    own_pool = pool is None
+    if own_pool:
+        import multiprocessing
+        pool = multiprocessing.Pool(processes=processes)
+    chunks = gmm._sample_chunks(N, processes)
+    results = [pool.apply_async(_assign_chunk, (gmm, data[i:j], covar[i:j] if per_sample else covar, None if covar_index is None else covar_index[i:j])) for i,j in chunks]
+    results = [r.get() for r in results]
+    if own_pool:
+        pool.close()
+    label = np.concatenate([r[0] for r in results])
+    chi2 = np.concatenate([r[1] for r in results])
+
+    # sensitivity bound: alpha chi2_i / c + 2 alpha c_k / c + 4 W / W_k
+    # for the (weighted) mean chi2 c of all samples, c_k of the samples
+    # assigned to component k, and the total weights W and W_k
+    w = np.ones(N) if weights is None else weights
+    W = w.sum()
+    W_k = np.bincount(label, weights=w, minlength=gmm.K)
+    c_k = np.bincount(label, weights=w * chi2, minlength=gmm.K)
+    c = c_k.sum() / W
+    c_k[W_k > 0] /= W_k[W_k > 0]
+    alpha = 16 * (np.log(gmm.K) + 2)
+    s = alpha * chi2 / c + 2 * alpha * c_k[label] / c + 4 * W / W_k[label]
+    p = w * s
+    p /= p.sum()
+
+    draws = rng.choice(N, size=size, p=p)
+    indices, counts = np.unique(draws, return_counts=True)
+    return indices, counts * w[indices] / (size * p[indices])
+
+# most likely component of each sample in coords, and the chi2 with respect to it
+def _assign_chunk(gmm, coords, covar=None, covar_index=None):
+    best = np.full(len(coords), -np.inf)
+    label = np.zeros(len(coords), dtype='int')
+    chi2 = np.zeros(len(coords))
+    for k in xrange(gmm.K):
+        chi2_k, log_norm = gmm._chi2_k(k, coords, covar=covar, covar_index=covar_index)
+        log_p = log_norm - chi2_k/2
+        sel = log_p > best
+        best[sel], label[sel], chi2[sel] = log_p[sel], k, chi2_k[sel]
+    return label, chi2
+
+# kwargs of fit() for the samples in index:
+# per-sample arrays are indexed, covar tables or shared covar are kept
+def _sample_kwargs(kwargs, index):
+    kwargs = dict(kwargs)
+    keys = ["R", "covar_index", "weights"]
+    if kwargs.get("covar_index", None) is None and np.ndim(kwargs.get("covar", None)) == 3:
+        keys.append("covar")
+    for key in keys:
+        if kwargs.get(key, None) is not None:
+            kwargs[key] = kwargs[key][index]
+    return kwargs
+
+
+def fit_coreset(gmm, data, size, polish=0, rough_iter=10, pool=None, processes=None, rng=np.random, **kwargs):
+    """Fit GMM to a coreset of data, optionally polish on all data.
+
+    For very large N, a rough model is fit to size randomly selected samples
+    for rough_iter iterations. From it, a coreset of data is constructed
+    (see coreset()), and the model is fit to the coreset, starting from the
+    rough model. Finally, if polish is set, the model is refined with at most
+    polish EM iterations on all data.
+
+    Args:
+        gmm: an instance if GMM
+        data: numpy array (N,D), without missing features
+        size (int): size of the random subset and number of coreset draws
+        polish (int): maximum number of EM iterations on all data
+        rough_iter (int): maximum number of EM iterations of the rough model
+        pool: multiprocessing.Pool to use, will be created if None
+        processes (int): number of processes to use, defaults to all
+        rng: numpy.random.RandomState for deterministic behavior
+        kwargs: additional arguments for fit(), R is not supported
+
+    Returns:
+        mean log-likelihood (float) and component neighborhoods (list of ints)
+        of the last fit, which refer to data if polish is set and to the
+        coreset otherwise, and the sample indices and weights of the coreset
+
+    Throws:
+        NotImplementedError for missing features or R
+    """
+    if kwargs.get("R", None) is not None:
+        raise NotImplementedError("fit_coreset does not support R")
+    if np.isnan(data).any():
+        raise NotImplementedError("fit_coreset does not support missing features")
+    own_pool = pool is None
+    if own_pool:
+        import multiprocessing
+        pool = multiprocessing.Pool(processes=processes)
+
+    try:
+        # rough model from a random subset
+        N = len(data)
+        subset = np.sort(rng.choice(N, size=min(size, N), replace=False))
+        gmm0 = _copy_gmm(gmm)
+        fit(gmm0, data[subset], pool=pool, processes=processes, rng=rng, **dict(_sample_kwargs(kwargs, subset), maxiter=rough_iter))
+        logger.info("building coreset from rough model")
+        indices, weights = coreset(gmm0, data, size, covar=kwargs.get("covar", None), covar_index=kwargs.get("covar_index", None), weights=kwargs.get("weights", None), pool=pool, processes=processes, rng=rng)
+        logger.info("fitting coreset of %d samples" % indices.size)
+        _copy_params(gmm, gmm0)
+        kwargs_ = dict(_sample_kwargs(kwargs, indices), weights=weights, init_method='none')
+        log_L, U = fit(gmm, data[indices], pool=pool, processes=processes, rng=rng, **kwargs_)
+        if polish:
+            logger.info("polishing on all data")
+            log_L, U = fit(gmm, data, pool=pool, processes=processes, rng=rng, **dict(kwargs, init_method='none', maxiter=polish))
+    finally:
+        if own_pool:
+            pool.close()
+    return log_L, U, indices, weights
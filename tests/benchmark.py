@@ -0,0 +1,251 @@
+#!/bin/env python
+
+# Timing of the hot paths of pygmmis for a grid of N, K, D, and noise modes.
+# Results are written as JSON, together with the git commit, so that runs from
+# different commits can be compared:
+#
+#   python benchmark.py -o before.json
+#   ... change code ...
+#   python benchmark.py -o after.json
+#   python benchmark.py --compare before.json after.json
+#
+# With numba installed, --jit uses the JIT kernels (pygmmis.use_jit), and
+# --check-jit compares the results of both code paths.
+
+import pygmmis
+import numpy as np
+import argparse, itertools, json, multiprocessing, os, platform, subprocess, sys, time
+
+noise_modes = ["none", "shared", "per-sample", "grouped", "R"]
+
+def commitHash():
+    try:
+        path = os.path.dirname(os.path.abspath(pygmmis.__file__))
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=path, stderr=open(os.devnull, "w")).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def timeit(func, repeat=5):
+    """Runs func repeat times, returns list of execution times in seconds."""
+    times = []
+    for r in range(repeat):
+        t0 = time.time()
+        func()
+        times.append(time.time() - t0)
+    return times
+
+def selection(coords):
+    return coords[:,0] < 0.5
+
+def createProblem(N, K, D, noise, rng):
+    """Draws N samples from a random K-component GMM in D dimensions.
+
+    Returns:
+        gmm, data, covar, R, covar_callback
+    """
+    gmm = pygmmis.GMM(K=K, D=D)
+    gmm.amp[:] = rng.rand(K) + 0.5
+    gmm.amp /= gmm.amp.sum()
+    gmm.mean[:,:] = rng.rand(K, D)
+    gmm.covar[:,:,:] = np.eye(D)[None,:,:] * (0.01 + 0.02 * rng.rand(K))[:,None,None]
+    data = gmm.draw(N, rng=rng)
+
+    disp = 0.05
+    covar, R, covar_callback = None, None, None
+    if noise == "shared":
+        covar = disp**2 * np.eye(D)
+        covar_callback = lambda coords: covar
+    elif noise == "per-sample":
+        covar = (disp**2 * (0.5 + rng.rand(N)))[:,None,None] * np.eye(D)[None,:,:]
+        covar_callback = lambda coords: (disp**2 * (0.5 + np.random.rand(len(coords))))[:,None,None] * np.eye(D)[None,:,:]
+    elif noise == "grouped":
+        # few distinct covariances, e.g. one per instrument: a tenth of the
+        # number up to which samples are grouped by covariance
+        table = (disp**2 * (0.5 + rng.rand(max(1, N * D**3 // 50000))))[:,None,None] * np.eye(D)[None,:,:]
+        covar = table[rng.randint(len(table), size=N)]
+        covar_callback = lambda coords: table[np.random.randint(len(table), size=len(coords))]
+    elif noise == "R":
+        # observe in randomly rotated frames
+        R = np.linalg.qr(rng.normal(size=(N, D, D)))[0]
+        data = np.einsum('...ij,...j', R, data)
+        covar = disp**2 * np.eye(D)
+    if covar is not None:
+        data = data + rng.normal(0, scale=disp, size=data.shape)
+    return gmm, data, covar, R, covar_callback
+
+def groupState(covar):
+    """Returns covar and groups as fit passes them to _Esum."""
+    if covar is None or covar.ndim == 2:
+        return covar, None
+    table, index = pygmmis._unique_covar(covar)
+    if table is None:
+        return covar, None
+    return None, (None, table, index)
+
+def estepState(gmm, data, covar, R, cutoff, groups=None):
+    """Runs _Esum for all components and returns the E-step state."""
+    N = len(data)
+    log_p, U, T_inv = [], [], []
+    log_S = np.zeros(N)
+    for k in range(gmm.K):
+        log_p_k, U_k, T_inv_k = pygmmis._Esum(k, None, gmm, data, covar, R, cutoff, groups)
+        log_p.append(log_p_k.copy())
+        U.append(U_k)
+        if isinstance(T_inv_k, tuple): # grouped
+            T_inv_k = (T_inv_k[0].copy(), T_inv_k[1].copy())
+        elif T_inv_k is not None:
+            T_inv_k = T_inv_k.copy()
+        T_inv.append(T_inv_k)
+        log_S[U_k] += np.exp(log_p_k)
+    H = log_S > 0
+    log_S[H] = np.log(log_S[H])
+    return log_p, U, T_inv, log_S
+
+def runBenchmarks(N, K, D, noise, repeat, pool, seed=42, fit_kwargs=None):
+    rng = np.random.RandomState(seed)
+    gmm, data, covar, R, covar_callback = createProblem(N, K, D, noise, rng)
+    cutoff = 5
+    chi2_cutoff = pygmmis.chi2_cutoff(D, cutoff=cutoff)
+    results = {}
+
+    if R is None:
+        results["GMM.logL"] = timeit(lambda: gmm.logL(data, covar=covar, pool=pool), repeat)
+    results["GMM.draw"] = timeit(lambda: gmm.draw(N, rng=rng), repeat)
+
+    covar_, groups = groupState(covar)
+    log_p, U, T_inv, log_S = estepState(gmm, data, covar_, R, chi2_cutoff, groups)
+    results["_Esum"] = timeit(lambda: [pygmmis._Esum(k, None, gmm, data, covar_, R, chi2_cutoff, groups) for k in range(K)], repeat)
+    results["_Msums"] = timeit(lambda: [pygmmis._Msums(k, U[k], log_p[k], T_inv[k], gmm, data, R, log_S) for k in range(K)], repeat)
+    if K >= 3:
+        results["_findSNMComponents"] = timeit(lambda: pygmmis._findSNMComponents(gmm, U, log_p, log_S, N, pool=pool), repeat)
+
+    if R is None:
+        results["draw+selection"] = timeit(lambda: pygmmis.draw(gmm, N, sel_callback=selection, covar_callback=covar_callback, rng=rng), repeat)
+
+    # full fit: one run per seed, iterations recorded for reference
+    kwargs = {"w": 0.1, "cutoff": cutoff, "tol": 1e-3, "maxiter": 200}
+    kwargs.update(fit_kwargs or {})
+    iterations = []
+    def fit():
+        metrics = pygmmis.FitMetrics()
+        gmm_ = pygmmis.GMM(K=K, D=D)
+        pygmmis.fit(gmm_, data, covar=covar, R=R, metrics=metrics, pool=pool, rng=np.random.RandomState(seed), **kwargs)
+        iterations.append(len(metrics.iterations))
+    results["fit"] = timeit(fit, max(1, repeat // 2))
+
+    records = []
+    for name, times in results.items():
+        record = {"name": name, "N": N, "K": K, "D": D, "noise": noise, "repeat": len(times), "best": min(times), "median": float(np.median(times))}
+        if name == "fit":
+            record["iterations"] = iterations
+        records.append(record)
+    return records
+
+def checkJIT(N, K, D, noise, seed=42, rtol=1e-10):
+    """Compares _Esum and _Msums results of the JIT and numpy code paths.
+
+    Returns:
+        maximum relative difference, or None if JIT is not available
+    """
+    if noise not in ["per-sample", "R"]:
+        return 0.
+    use_jit = pygmmis.use_jit
+    pygmmis.use_jit = True
+    if pygmmis._get_jit() is None:
+        pygmmis.use_jit = use_jit
+        return None
+    rng = np.random.RandomState(seed)
+    gmm, data, covar, R, covar_callback = createProblem(N, K, D, noise, rng)
+    cutoff = pygmmis.chi2_cutoff(D, cutoff=5)
+    results = []
+    for jit in [False, True]:
+        pygmmis.use_jit = jit
+        log_p, U, T_inv, log_S = estepState(gmm, data, covar, R, cutoff)
+        sums = [pygmmis._Msums(k, U[k], log_p[k], T_inv[k], gmm, data, R, log_S) for k in range(K)]
+        results.append([np.concatenate(log_p), np.concatenate(T_inv).flatten()] + [np.array([s[i] for s in sums]).flatten() for i in range(3)])
+    pygmmis.use_jit = use_jit
+    diff = 0.
+    for a, b in zip(*results):
+        diff = max(diff, np.max(np.abs(a - b) / np.maximum(np.abs(a), 1)))
+    if diff > rtol:
+        raise AssertionError("JIT and numpy results differ by %r for N=%d, K=%d, D=%d, noise=%s" % (diff, N, K, D, noise))
+    return diff
+
+def key(record):
+    return (record["name"], record["N"], record["K"], record["D"], record["noise"])
+
+def compare(filename0, filename1, threshold=0.1):
+    with open(filename0) as fp:
+        run0 = json.load(fp)
+    with open(filename1) as fp:
+        run1 = json.load(fp)
+    best0 = dict((key(r), r["best"]) for r in run0["results"])
+    print ("# %s (%s) -> %s (%s)" % (filename0, run0["commit"], filename1, run1["commit"]))
+    print ("NAME\tN\tK\tD\tNOISE\tBEFORE\tAFTER\tRATIO")
+    regressions = 0
+    for r in run1["results"]:
+        k = key(r)
+        if k not in best0:
+            continue
+        ratio = r["best"] / best0[k]
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "\t*"
+            regressions += 1
+        print ("%s\t%d\t%d\t%d\t%s\t%.4f\t%.4f\t%.2f%s" % (k + (best0[k], r["best"], ratio, flag)))
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark pygmmis hot paths")
+    parser.add_argument("-N", type=int, nargs="+", default=[1000, 10000], help="number of samples")
+    parser.add_argument("-K", type=int, nargs="+", default=[5, 20], help="number of components")
+    parser.add_argument("-D", type=int, nargs="+", default=[2, 5], help="dimensions")
+    parser.add_argument("--noise", nargs="+", default=noise_modes, choices=noise_modes, help="noise modes")
+    parser.add_argument("--repeat", type=int, default=5, help="repetitions per kernel")
+    parser.add_argument("--processes", type=int, default=None, help="size of the pool")
+    parser.add_argument("-o", "--output", default=None, help="JSON file to store results")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="compare two result files")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative slowdown flagged as regression")
+    parser.add_argument("--jit", action="store_true", help="use the JIT kernels if numba is installed")
+    parser.add_argument("--check-jit", action="store_true", help="check that JIT and numpy code paths agree")
+    args = parser.parse_args()
+
+    if args.compare:
+        regressions = compare(args.compare[0], args.compare[1], threshold=args.threshold)
+        sys.exit(1 if regressions else 0)
+
+    if args.check_jit:
+        print ("NAME\tN\tK\tD\tNOISE\tMAX_REL_DIFF")
+        for N, K, D, noise in itertools.product(args.N, args.K, args.D, args.noise):
+            diff = checkJIT(N, K, D, noise)
+            if diff is None:
+                print ("JIT not available")
+                sys.exit(1)
+            print ("check-jit\t%d\t%d\t%d\t%s\t%.2e" % (N, K, D, noise, diff))
+        sys.exit(0)
+
+    pygmmis.use_jit = args.jit
+    pool = multiprocessing.Pool(processes=args.processes)
+    results = []
+    print ("NAME\tN\tK\tD\tNOISE\tBEST\tMEDIAN")
+    for N, K, D, noise in itertools.product(args.N, args.K, args.D, args.noise):
+        for r in runBenchmarks(N, K, D, noise, args.repeat, pool):
+            print ("%s\t%d\t%d\t%d\t%s\t%.4f\t%.4f" % (key(r) + (r["best"], r["median"])))
+            results.append(r)
+    pool.close()
+    pool.join()
+
+    run = {
+        "commit": commitHash(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "cpus": multiprocessing.cpu_count(),
+        "processes": args.processes,
+        "jit": pygmmis._get_jit() is not None,
+        "results": results
+    }
+    if args.output is not None:
+        with open(args.output, "w") as fp:
+            json.dump(run, fp, indent=1)
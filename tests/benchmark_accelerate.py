@@ -0,0 +1,66 @@
+#!/bin/env python
+
+import pygmmis
+import numpy as np
+import logging
+import time
+
+class IterationCounter(logging.Handler):
+    """Counts EM iterations and rejected extrapolations from the fit log."""
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.iterations = 0
+        self.rejected = 0
+
+    def emit(self, record):
+        message = record.getMessage()
+        if message[:1].isdigit():
+            self.iterations += 1
+        if "extrapolation rejected" in message:
+            self.rejected += 1
+
+def runFit(data, K, accelerate, seed, **kwargs):
+    logger = logging.getLogger("pygmmis")
+    counter = IterationCounter()
+    logger.addHandler(counter)
+    gmm = pygmmis.GMM(K=K, D=data.shape[1])
+    rng = np.random.RandomState(seed)
+    t0 = time.time()
+    logL, U = pygmmis.fit(gmm, data, accelerate=accelerate, rng=rng, **kwargs)
+    dt = time.time() - t0
+    logger.removeHandler(counter)
+    return logL, counter.iterations, counter.rejected, dt
+
+if __name__ == '__main__':
+
+    # set up benchmark
+    N = 5000            # number of samples
+    K = 5               # number of components
+    D = 2               # dimensions
+    disps = [0.5, 1, 2] # additive noise dispersion
+    cutoff = 5          # cutoff distance between components [sigma]
+    tol = 1e-3          # tolerance on logL to terminate EM
+    seeds = range(5)    # seed values for fits
+
+    logger = logging.getLogger("pygmmis")
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+    # draw N points from K-component GMM
+    rng = np.random.RandomState(42)
+    gmm = pygmmis.GMM(K=K, D=D)
+    gmm.amp[:] = rng.rand(K)
+    gmm.amp /= gmm.amp.sum()
+    gmm.mean[:,:] = rng.rand(K, D) * 10
+    gmm.covar[:,:,:] = np.eye(D)[None,:,:] * (0.5 + rng.rand(K))[:,None,None]
+    orig = gmm.draw(N, rng=rng)
+
+    print ("DISP\tACCEL\tITER\tREJECT\tTIME\tLOG_L")
+    for disp in disps:
+        # add isotropic errors on data
+        noisy = orig + rng.normal(0, scale=disp, size=orig.shape)
+        covar = disp**2 * np.eye(D)
+        for accelerate in [False, True]:
+            results = np.array([runFit(noisy, K, accelerate, seed, covar=covar, cutoff=cutoff, tol=tol) for seed in seeds])
+            logL, it, rejected, dt = results.mean(axis=0)
+            print ("%.1f\t%r\t%.1f\t%.1f\t%.2f\t%.4f" % (disp, accelerate, it, rejected, dt, logL))
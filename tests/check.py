@@ -0,0 +1,117 @@
+#!/bin/env python
+
+# Consistency checks of code paths in pygmmis that need to agree:
+#
+#   python check.py
+#
+# Each check prints its result, failed checks raise an AssertionError.
+# Checks that need optional packages are skipped if they are not installed.
+
+import pygmmis
+import numpy as np
+import itertools
+
+from benchmark import checkJIT
+
+def checkJITAgreement():
+    """Compares the numba kernels with the numpy code paths."""
+    pygmmis.use_jit = True
+    available = pygmmis._get_jit() is not None
+    pygmmis.use_jit = False
+    if not available:
+        print ("jit\tSKIPPED (numba not installed)")
+        return
+    for N, K, D, noise in itertools.product([500], [3], [2, 5], ["per-sample", "R"]):
+        diff = checkJIT(N, K, D, noise)
+        print ("jit\tN=%d K=%d D=%d %s\tmax rel diff %.2e" % (N, K, D, noise, diff))
+
+def checkRestartTypes():
+    """Checks that fit_restarts keeps the covariance type of the model."""
+    rng = np.random.RandomState(0)
+    data = np.concatenate([rng.normal(size=(300,2)), rng.normal(size=(300,2)) + 5])
+    for covariance_type, rank in [("diag", None), ("spherical", None), ("tied", None), ("lowrank", 1)]:
+        gmm = pygmmis.GMM(K=2, D=2, covariance_type=covariance_type, rank=rank)
+        log_L, U, log_Ls = pygmmis.fit_restarts(gmm, data, n_init=2, processes=2, rng=rng)
+        assert gmm.covariance_type == covariance_type
+        print ("restarts\t%s\tlog_L %.3f" % (covariance_type, log_L))
+
+class Interrupt(Exception):
+    pass
+
+def checkResume():
+    """Checks that a fit resumed from a checkpoint ends like an uninterrupted one."""
+    import shutil, tempfile
+    rng = np.random.RandomState(0)
+    data = np.concatenate([rng.normal(size=(300,2)), rng.normal(size=(300,2)) + 5, rng.normal(size=(300,2)) + [0, 5]])
+    save = pygmmis._Checkpoint.save
+    for init_method in ["random", "minmax", "kmeans"]:
+        # kmeans2 draws from the global RNG
+        np.random.seed(1)
+        gmm = pygmmis.GMM(K=3, D=2)
+        log_L, U = pygmmis.fit(gmm, data, init_method=init_method, w=0.01, tol=1e-6, rng=np.random.RandomState(2))
+
+        # interrupt after the third checkpoint, then resume
+        path = tempfile.mkdtemp()
+        calls = [0]
+        def interrupted_save(self, *args, **kwargs):
+            save(self, *args, **kwargs)
+            calls[0] += 1
+            if calls[0] == 3:
+                raise Interrupt()
+        pygmmis._Checkpoint.save = interrupted_save
+        np.random.seed(1)
+        try:
+            pygmmis.fit(pygmmis.GMM(K=3, D=2), data, init_method=init_method, w=0.01, tol=1e-6, checkpoint=path, checkpoint_interval=1, rng=np.random.RandomState(2))
+            raise AssertionError("fit was not interrupted")
+        except Interrupt:
+            pass
+        finally:
+            pygmmis._Checkpoint.save = save
+        np.random.seed(3) # a different init must not matter
+        gmm_ = pygmmis.GMM(K=3, D=2)
+        log_L_, U_ = pygmmis.fit(gmm_, data, init_method=init_method, w=0.01, tol=1e-6, checkpoint=path, checkpoint_interval=1, resume=True, rng=np.random.RandomState(4))
+        shutil.rmtree(path)
+        assert np.allclose(log_L, log_L_) and np.allclose(gmm.mean, gmm_.mean), (init_method, log_L, log_L_)
+        print ("resume\t%s\tlog_L %.3f, resumed %.3f" % (init_method, log_L, log_L_))
+
+def checkRestartCheckpoints():
+    """Checks that concurrent restarts keep separate checkpoints."""
+    import os, shutil, tempfile
+    rng = np.random.RandomState(0)
+    data = np.concatenate([rng.normal(size=(300,2)), rng.normal(size=(300,2)) + 5])
+    path = tempfile.mkdtemp()
+    kwargs = dict(n_init=4, prune=None, processes=4, w=0.01, checkpoint=path, checkpoint_interval=1)
+    log_L, U, log_Ls = pygmmis.fit_restarts(pygmmis.GMM(K=2, D=2), data, rng=np.random.RandomState(1), **kwargs)
+    assert sorted(os.listdir(path)) == ["0", "1", "2", "3"]
+    log_L_, U_, log_Ls_ = pygmmis.fit_restarts(pygmmis.GMM(K=2, D=2), data, rng=np.random.RandomState(1), resume=True, **kwargs)
+    shutil.rmtree(path)
+    assert np.allclose(log_Ls, log_Ls_)
+    print ("restarts\tcheckpoints\tlog_L %.3f, resumed %.3f" % (log_L, log_L_))
+
+def checkNoiseTypes():
+    """Compares each covariance type with the equivalent full model under noise."""
+    rng = np.random.RandomState(0)
+    K, D, N = 3, 2, 50
+    coords = rng.normal(size=(N, D)) * 2
+    noise = np.array([[1, .9], [.9, 1]])
+    per_sample = np.repeat(noise[None], N, axis=0) * (0.5 + rng.rand(N))[:,None,None]
+    for covariance_type, rank in [("diag", None), ("spherical", None), ("tied", None), ("lowrank", 1)]:
+        gmm = pygmmis.GMM(K=K, D=D, covariance_type=covariance_type, rank=rank)
+        gmm.amp[:] = 1. / K
+        gmm.mean[:,:] = rng.normal(size=(K, D))
+        covar = np.eye(D) * (0.5 + rng.rand(K, D))[:,:,None]
+        covar[:, 0, 1] = covar[:, 1, 0] = 0.2
+        gmm.covar = covar
+        full = pygmmis.GMM(K=K, D=D)
+        full.amp[:] = gmm.amp
+        full.mean[:,:] = gmm.mean
+        full.covar[:,:,:] = gmm.covar
+        for name, covar in [("none", None), ("shared", noise), ("per-sample", per_sample)]:
+            diff = np.abs(gmm.logL(coords, covar=covar, processes=1) - full.logL(coords, covar=covar, processes=1)).max()
+            assert diff < 1e-10, (covariance_type, name, diff)
+            print ("noise\t%s\t%s\tmax diff %.2e" % (covariance_type, name, diff))
+
+if __name__ == '__main__':
+    checks = [checkJITAgreement, checkRestartTypes, checkResume, checkRestartCheckpoints, checkNoiseTypes]
+    for check in checks:
+        check()
@@ -26,11 +26,10 @@ def plotResults(orig, data, gmm, patch=None, description=None, disp=None):
 
     # prediction
     B = 100
-    x,y = np.meshgrid(np.linspace(-5,15,B), np.linspace(-5,15,B))
-    coords = np.dstack((x.flatten(), y.flatten()))[0]
+    x = np.linspace(-5,15,B)
 
-    # compute sum_k(p_k(x)) for all x
-    p = gmm(coords).reshape((B,B))
+    # compute sum_k(p_k(x)) for all x on the grid, y as first axis for plotting
+    p = gmm.grid([x, x]).T
     # for better visibility use arcshinh stretch
     p = np.arcsinh(p/1e-4)
     cs = ax.contourf(p, 10, extent=(-5,15,-5,15), cmap=plt.cm.Greys)